@@ -1,4 +1,6 @@
 class Group:
+    __slots__ = ("peer", "user_ids", "title", "shortname", "invite_url")
+
     def __init__(self, peer, user_ids, title, shortname, invite_url):
         self.peer = peer
         self.user_ids = user_ids
@@ -1,8 +1,9 @@
 class User:
+    __slots__ = ("outpeer", "groups", "reminder", "buttons_mids", "remind_times")
+
     def __init__(self, outpeer, groups):
         self.outpeer = outpeer
         self.groups = groups
-        self.mentions = {}
         self.reminder = []
         self.buttons_mids = []
-        self.remind_time = None
+        self.remind_times = []
@@ -0,0 +1,140 @@
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import i18n
+from dialog_api import definitions_pb2, peers_pb2
+
+from benchmarks.fake_bot import FakeDialogBot
+from bot import Bot
+
+BOT_ID = 1
+COMMANDS = {
+    "start": "start",
+    "stop": "stop",
+    "get_mentions": "mentions",
+    "get_groups": "subscriptions",
+    "set_reminder": "schedule",
+    "help": "commands",
+}
+
+
+def make_groups(groups, members, users):
+    population = range(BOT_ID + 1, users + BOT_ID + 1)
+    result = {}
+    for gid in range(1, groups + 1):
+        result[100000 + gid] = [BOT_ID] + random.sample(population, min(members, users))
+    return result
+
+
+def make_update(gid, uid, mentions, mid):
+    return SimpleNamespace(
+        peer=peers_pb2.Peer(type=peers_pb2.PEERTYPE_GROUP, id=gid),
+        sender_uid=uid,
+        mid=definitions_pb2.UUIDValue(msb=1, lsb=mid),
+        message=SimpleNamespace(
+            textMessage=SimpleNamespace(text="hello", mentions=mentions),
+            serviceMessage=SimpleNamespace(ext=None),
+        ),
+    )
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(args):
+    random.seed(args.seed)
+    groups = make_groups(args.groups, args.members, args.users)
+    fake = FakeDialogBot(groups, latency=args.latency, bot_id=BOT_ID)
+    database = os.path.join(tempfile.mkdtemp(), "bench.db")
+    config = {
+        "bot": {},
+        "commands": COMMANDS,
+        "lang": "en",
+        "timezone": "+0000",
+        "database": database,
+        "delivery": {"workers": args.workers},
+        "outbox": {"rate": 0, "peer_rate": 0},
+        "members_resync": 0,
+    }
+    bot = Bot(config, bot=fake)
+    bot.preprocessing_from_database()
+
+    started = time.perf_counter()
+    bot.get_default_groups()
+    print("groups loaded:       {0} in {1:.2f}s".format(len(bot.default_tracked_groups), time.perf_counter() - started))
+
+    uids = sorted({uid for members in groups.values() for uid in members if uid != BOT_ID})
+    tracked = uids[:int(len(uids) * args.tracked)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for uid in tracked:
+        bot.add_tracked_user(peers_pb2.Peer(type=peers_pb2.PEERTYPE_PRIVATE, id=uid))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print("tracked users:       {0}, {1:.0f} bytes per user".format(len(tracked), used / max(1, len(tracked))))
+
+    gids = list(groups)
+    updates = []
+    for i in range(args.messages):
+        gid = random.choice(gids)
+        members = groups[gid]
+        if random.random() < args.all_ratio:
+            mentions = [0]
+        else:
+            mentions = random.sample(members, min(args.mentions, len(members)))
+        updates.append(make_update(gid, random.choice(members), mentions, i + 1))
+
+    latencies = []
+    started = time.perf_counter()
+    for update in updates:
+        t = time.perf_counter()
+        bot.on_msg(update)
+        latencies.append(time.perf_counter() - t)
+    bot.mentions.flush()
+    elapsed = time.perf_counter() - started
+    print("on_msg:              {0:.0f} msg/s, p50 {1:.1f}us, p99 {2:.1f}us, max {3:.1f}us".format(
+        len(updates) / elapsed, statistics.median(latencies) * 1e6, percentile(latencies, 0.99) * 1e6,
+        max(latencies) * 1e6))
+
+    remind = "09:00"
+    reminded = [uid for uid in tracked if random.random() < args.reminder_density]
+    for uid in reminded:
+        bot.add_remind(uid, remind)
+    calls = fake.calls
+    started = time.perf_counter()
+    due = bot.reminder.due(9 * 60)
+    for uid in due:
+        bot.delivery.submit(uid, bot.send_mentions_for_user, peers_pb2.Peer(type=peers_pb2.PEERTYPE_PRIVATE, id=uid))
+    bot.delivery.join()
+    print("cron fan-out:        {0} users in {1:.2f}s, {2} RPCs".format(
+        len(due), time.perf_counter() - started, fake.calls - calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic group traffic through the bot against a fake SDK")
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--tracked", type=float, default=0.5, help="share of group members that run start")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--mentions", type=int, default=2, help="explicit mentions per message")
+    parser.add_argument("--all-ratio", type=float, default=0.05, help="share of messages that mention @all")
+    parser.add_argument("--reminder-density", type=float, default=0.3, help="share of tracked users with a reminder")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake RPC")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    i18n.load_path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "translations"))
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import os
+import timeit
+from types import SimpleNamespace
+
+import i18n
+
+from bot import Bot, LOCALES, PHRASES
+from phrases import Phrases
+
+
+def report(name, before, after, number):
+    print("{0:<28} before {1:8.2f}us, after {2:8.2f}us ({3:.1f}x)".format(
+        name, before / number * 1e6, after / number * 1e6, before / after))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare i18n lookups and media building with the precompiled cache")
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+    i18n.load_path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "translations"))
+
+    phrases = Phrases(LOCALES)
+    number = args.number
+    before = timeit.timeit(lambda: i18n.t(PHRASES + '.start group', locale="ru").format("@group"), number=number)
+    after = timeit.timeit(lambda: phrases.t(PHRASES + '.start group', locale="ru").format("@group"), number=number)
+    report("phrase + format", before, after, number)
+
+    legacy = SimpleNamespace(phrases=i18n)
+    bot = Bot.__new__(Bot)
+    bot.phrases = phrases
+    bot.interactive = {}
+    number = max(1, args.number // 100)
+    before = timeit.timeit(lambda: Bot.build_interactive_reminder(legacy, "ru"), number=number)
+    after = timeit.timeit(lambda: Bot.interactive_reminder(bot, "ru"), number=number)
+    report("reminder selects", before, after, number)
+
+    before = timeit.timeit(lambda: Bot.interactive_stop(SimpleNamespace(phrases=i18n, interactive={}), 100, "ru"),
+                           number=number)
+    after = timeit.timeit(lambda: Bot.interactive_stop(bot, 100, "ru"), number=number)
+    report("group stop button", before, after, number)
+
+
+if __name__ == '__main__':
+    main()
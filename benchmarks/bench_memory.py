@@ -0,0 +1,113 @@
+import argparse
+import gc
+import os
+import random
+import tempfile
+import tracemalloc
+
+from dialog_api import definitions_pb2
+
+from Groups import Group
+from intset import IntSet
+from mentions import MentionStore
+from storage import Storage
+from Users import User
+
+
+class LegacyUser:
+    def __init__(self, outpeer, groups):
+        self.outpeer = outpeer
+        self.groups = groups
+        self.mentions = {}
+        self.reminder = []
+        self.buttons_mids = []
+        self.remind_time = None
+
+
+class LegacyGroup:
+    def __init__(self, peer, user_ids, title, shortname, invite_url):
+        self.peer = peer
+        self.user_ids = user_ids
+        self.title = title
+        self.shortname = shortname
+        self.invite_url = invite_url
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = build()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del objects
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory of the user and group models with the old ones")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--groups", type=int, default=1000)
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--groups-per-user", type=int, default=10)
+    parser.add_argument("--mentions-per-user", type=int, default=20,
+                        help="pending mentions the old model kept in memory, now stored in the database")
+    parser.add_argument("--mention-users", type=int, default=5000, help="users with pending mentions to store")
+    args = parser.parse_args()
+
+    random.seed(0)
+    uids = list(range(1000, 1000 + args.users))
+    gids = list(range(100000, 100000 + args.groups))
+    memberships = {uid: random.sample(gids, args.groups_per_user) for uid in uids}
+    rosters = {gid: random.sample(uids, args.members) for gid in gids}
+
+    def legacy_users():
+        return {uid: LegacyUser(None, set(memberships[uid])) for uid in uids}
+
+    def users():
+        return {uid: User(None, IntSet(memberships[uid])) for uid in uids}
+
+    def legacy_groups():
+        return {gid: LegacyGroup(None, set(rosters[gid]), "title", "shortname", "url") for gid in gids}
+
+    def groups():
+        return {gid: Group(None, IntSet(rosters[gid]), "title", "shortname", "url") for gid in gids}
+
+    members = args.groups * args.members
+    legacy = measure(legacy_users) / args.users
+    current = measure(users) / args.users
+    print("bytes per tracked user:  before {0:.0f}, after {1:.0f} ({2:.1f}x)".format(legacy, current, legacy / current))
+    legacy = measure(legacy_groups) / members
+    current = measure(groups) / members
+    print("bytes per group member:  before {0:.1f}, after {1:.1f} ({2:.1f}x)".format(legacy, current, legacy / current))
+
+    mention_uids = uids[:args.mention_users]
+    mentions = args.mention_users * args.mentions_per_user
+
+    def legacy_mentions():
+        result = {}
+        for uid in mention_uids:
+            pending = result[uid] = {}
+            for i in range(args.mentions_per_user):
+                mid = definitions_pb2.UUIDValue(msb=uid, lsb=i)
+                pending.setdefault(memberships[uid][i % args.groups_per_user], []).append(mid)
+        return result
+
+    legacy = measure(legacy_mentions) / mentions
+    path = os.path.join(tempfile.mkdtemp(), "mentions.db")
+    storage = Storage(path)
+    storage.migrate()
+    store = MentionStore(storage)
+    for uid in mention_uids:
+        for i in range(args.mentions_per_user):
+            store.add(uid, memberships[uid][i % args.groups_per_user], definitions_pb2.UUIDValue(msb=uid, lsb=i))
+    store.flush()
+    storage.connect.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    print("bytes per pending mention: before {0:.0f} in memory, after {1:.0f} on disk and none in memory once "
+          "flushed".format(legacy, os.path.getsize(path) / mentions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+
+from dialog_api import definitions_pb2, groups_pb2, messaging_pb2, miscellaneous_pb2, peers_pb2, \
+    sequence_and_updates_pb2
+from google.protobuf import wrappers_pb2
+
+
+class FakeService:
+    def __init__(self, bot):
+        self.bot = bot
+
+    def delay(self):
+        self.bot.calls += 1
+        if self.bot.latency:
+            time.sleep(self.bot.latency)
+
+
+class FakeMessaging(FakeService):
+    def send_message(self, peer, text, interactive_media_groups=None):
+        self.delay()
+        mid = self.bot.new_mid()
+        self.bot.messages[(mid.msb, mid.lsb)] = SimpleNamespace(
+            mid=mid, peer=peer, message=SimpleNamespace(textMessage=SimpleNamespace(text=text))
+        )
+        self.bot.sent += 1
+        return SimpleNamespace(message_id=mid)
+
+    def forward(self, peer, mids, text=None):
+        self.delay()
+        self.bot.forwarded += len(mids)
+        self.bot.sent += 1
+        return SimpleNamespace(message_id=self.bot.new_mid())
+
+    def update_message(self, message, text, interactive_media_groups=None):
+        self.delay()
+        self.bot.messages[(message.mid.msb, message.mid.lsb)].message.textMessage.text = text
+        self.bot.updated += 1
+
+    def get_messages_by_id(self, mids):
+        self.delay()
+        return [self.bot.messages[(mid.msb, mid.lsb)] for mid in mids]
+
+    def on_message(self, callback, interactive_media_callback=None, raw_callback=None):
+        self.bot.callbacks = (callback, interactive_media_callback, raw_callback)
+
+
+class FakeUsers(FakeService):
+    def get_user_by_id(self, uid):
+        self.delay()
+        return SimpleNamespace(data=SimpleNamespace(locales=[self.bot.locale], time_zone=self.bot.time_zone))
+
+
+class FakeInternalMessaging(FakeService):
+    def LoadDialogs(self, request):
+        self.delay()
+        return messaging_pb2.ResponseLoadDialogs(group_peers=[
+            peers_pb2.GroupOutPeer(group_id=gid, access_hash=gid) for gid in self.bot.groups
+        ])
+
+    def UpdateMessage(self, request):
+        self.delay()
+        self.bot.messages[(request.mid.msb, request.mid.lsb)].message.textMessage.text = \
+            request.updated_message.textMessage.text
+        self.bot.updated += 1
+        return miscellaneous_pb2.ResponseSeqDate()
+
+
+class FakeInternalUpdates(FakeService):
+    def GetReferencedEntitites(self, request):
+        self.delay()
+        return sequence_and_updates_pb2.ResponseGetReferencedEntitites(groups=[
+            groups_pb2.Group(id=peer.group_id, access_hash=peer.access_hash, data=groups_pb2.GroupData(
+                title="group {}".format(peer.group_id),
+                shortname=wrappers_pb2.StringValue(value="group{}".format(peer.group_id))
+            )) for peer in request.groups if peer.group_id in self.bot.groups
+        ])
+
+
+class FakeInternalGroups(FakeService):
+    def GetGroupInviteUrl(self, request):
+        self.delay()
+        return groups_pb2.ResponseInviteUrl(url="https://example.com/join/{}".format(request.group_peer.group_id))
+
+    def LoadMembers(self, request):
+        self.delay()
+        members = self.bot.groups[request.group.group_id]
+        offset = int(request.next.value or b"0") if request.HasField("next") else 0
+        page = members[offset:offset + request.limit]
+        response = groups_pb2.ResponseLoadMembers(members=[groups_pb2.Member(uid=uid) for uid in page])
+        if offset + request.limit < len(members):
+            response.cursor.value = str(offset + request.limit).encode()
+        return response
+
+
+class FakeManager(FakeService):
+    def get_outpeer(self, peer):
+        return peers_pb2.OutPeer(id=peer.id, type=peer.type, access_hash=peer.id)
+
+
+class FakeDialogBot:
+    def __init__(self, groups, latency=0.0, bot_id=1, locale="en", time_zone="+0000"):
+        self.groups = groups
+        self.latency = latency
+        self.locale = locale
+        self.time_zone = time_zone
+        self.calls = 0
+        self.sent = 0
+        self.forwarded = 0
+        self.updated = 0
+        self.messages = {}
+        self.callbacks = None
+        self._mids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.user_info = SimpleNamespace(user=SimpleNamespace(id=bot_id))
+        self.messaging = FakeMessaging(self)
+        self.users = FakeUsers(self)
+        self.manager = FakeManager(self)
+        self.internal = SimpleNamespace(
+            messaging=FakeInternalMessaging(self),
+            updates=FakeInternalUpdates(self),
+            groups=FakeInternalGroups(self),
+        )
+
+    def new_mid(self):
+        with self._lock:
+            return definitions_pb2.UUIDValue(msb=0, lsb=next(self._mids))
@@ -1,14 +1,27 @@
+import functools
 import os
 import threading
+import time
+import traceback
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-import i18n
-import sqlite3
+from types import SimpleNamespace
 import grpc
-from dialog_api import messaging_pb2, sequence_and_updates_pb2, peers_pb2, groups_pb2
+from dialog_api import definitions_pb2, messaging_pb2, sequence_and_updates_pb2, peers_pb2, groups_pb2
 from dialog_bot_sdk import interactive_media
 from dialog_bot_sdk.bot import DialogBot
 
+from cache import LRUCache
 from Groups import Group
+from intset import IntSet
+from mentions import MentionStore
+from metrics import Metrics, timed
+from outbox import RATE, Outbox
+from phrases import Phrases
+from scheduler import TimingWheel
+from storage import Storage
+from workers import WorkerPool
 from Users import User
 
 
@@ -16,9 +29,22 @@ HOURS = {}
 MINUTES = {}
 GROUPS_MEMBERS_FETCH_LIMIT = 1000
 CRON_TIME = 60
+PROFILE_CACHE_SIZE = 50000
+PROFILE_CACHE_TTL = 3600
+STARTUP_WORKERS = 16
+MEMBERS_RESYNC = 3600
+MAX_REMINDERS = 1
+DIGEST_MAX_FORWARD = 50
+BUTTONS_CACHE_SIZE = 100000
+DELIVERY_WORKERS = 8
+WORKERS = 8
+WORKERS_QUEUE_SIZE = 10000
+SNAPSHOT_INTERVAL = 10
+SERVICE_BODY = messaging_pb2.ServiceEx.DESCRIPTOR.oneofs[0].name
 PHRASES = 'phrases.phrases'
 MEDIA = 'phrases.media'
 LOCALES = ['en', 'ru']
+PROFILE_UPDATES = ("updateUserPreferredLanguagesChanged", "updateUserTimeZoneChanged")
 
 for i in range(25):
     HOURS[str(i)] = str(i)
@@ -26,35 +52,87 @@ for i in range(60):
     MINUTES[str(i)] = str(i)
 
 
+def get_bot(config):
+    return DialogBot.get_secure_bot(
+        config["bot"]["endpoint"],
+        grpc.ssl_channel_credentials(),
+        config["bot"]["token"]
+    )
+
+
 class Bot:
-    def __init__(self, config):
-        bot = config["bot"]
-        self.connect = sqlite3.connect(os.path.dirname(__file__) + config["database"], check_same_thread=False)
-        self.cursor = self.connect.cursor()
+    def __init__(self, config, bot=None, shard=0, shards=1):
+        self.shard = shard
+        self.shards = shards
+        database = config["database"]
+        if not os.path.isabs(database):
+            database = os.path.dirname(__file__) + database
+        self.storage = Storage(database)
+        self.mentions = MentionStore(self.storage, **config.get("mentions", {}))
         self.commands = config["commands"]
         self.locale = config["lang"]
         self.timezone = config["timezone"]
-        self.bot = DialogBot.get_secure_bot(
-            bot["endpoint"],
-            grpc.ssl_channel_credentials(),
-            bot["token"]
-        )
+        self.locales = LOCALES if self.locale in LOCALES else LOCALES + [self.locale]
+        self.phrases = Phrases(self.locales)
+        self.commands_text = {}
+        self.interactive = {}
+        for lang in self.locales:
+            self.commands_text[lang] = self.phrases.t(PHRASES + '.commands', locale=lang).format(
+                self.commands["start"], self.commands["stop"], self.commands["get_mentions"],
+                self.commands["set_reminder"], self.commands["get_groups"])
+            self.interactive[("reminder", lang)] = self.build_interactive_reminder(lang)
+        self.metrics = Metrics(**config.get("metrics", {}))
+        self.metrics.port += shard
+        if bot is None:
+            bot = get_bot(config)
+        self.bot = self.metrics.instrument(bot, "bot")
         self.tracked_users = {}
         self.default_tracked_groups = {}
-        self.reminder = {}
-        self.cron_time = CRON_TIME
+        self.subscribers = {}
+        self.state_lock = threading.RLock()
+        self.reminder = TimingWheel()
+        self.max_reminders = config.get("max_reminders", MAX_REMINDERS)
+        digest = config.get("digest", {})
+        self.digest = digest.get("enabled", False)
+        self.max_forward = digest.get("max_forward", DIGEST_MAX_FORWARD)
+        profile_cache = config.get("profile_cache", {})
+        self.profiles = LRUCache(profile_cache.get("size", PROFILE_CACHE_SIZE),
+                                 profile_cache.get("ttl", PROFILE_CACHE_TTL))
+        self.delivery = WorkerPool("delivery", config.get("delivery", {}).get("workers", DELIVERY_WORKERS))
+        outbox = dict(config.get("outbox", {}))
+        outbox["rate"] = outbox.get("rate", RATE) / shards
+        self.outbox = Outbox(self.bot.messaging, self.delivery, **outbox)
+        self.buttons = LRUCache(config.get("buttons_cache_size", BUTTONS_CACHE_SIZE))
+        self.startup_workers = config.get("startup_workers", STARTUP_WORKERS)
+        self.groups_loaded = threading.Event()
+        self.early_users = set()
+        self.members_resync = config.get("members_resync", MEMBERS_RESYNC)
+        self.snapshot_interval = config.get("snapshot_interval", SNAPSHOT_INTERVAL)
+        self.dirty_groups = set()
+        self.dirty_lock = threading.Lock()
+        self.service_handlers = {
+            "userInvited": self.on_user_invited,
+            "userJoined": self.on_user_joined,
+            "userKicked": self.on_user_kicked,
+            "userLeft": self.on_user_left,
+            "changedTitle": self.on_changed_title,
+        }
+        workers = config.get("workers", {})
+        self.workers = WorkerPool("handlers", workers.get("size", WORKERS),
+                                  workers.get("queue_size", WORKERS_QUEUE_SIZE), workers.get("policy", "block"))
 
     def cron(self):
         ticker = threading.Event()
-        while not ticker.wait(self.cron_time):
-            t = datetime.utcnow()
-            self.cron_time = CRON_TIME - int(t.strftime("%S"))
-            time = t.strftime("%H:%M")
-            if time in self.reminder:
-                for uid in self.reminder[time]:
-                    peer = peers_pb2.Peer(type=peers_pb2.PEERTYPE_PRIVATE, id=uid)
-                    self.send_mentions_for_user(peer)
-
+        self.reminder.due(int(time.time() // CRON_TIME))
+        while not ticker.wait(CRON_TIME - time.time() % CRON_TIME):
+            now = time.time()
+            if self.metrics.enabled:
+                self.metrics.observe("bot_cron_lag_seconds", now % CRON_TIME)
+            for uid in self.reminder.due(int(now // CRON_TIME)):
+                peer = peers_pb2.Peer(type=peers_pb2.PEERTYPE_PRIVATE, id=uid)
+                self.delivery.submit(uid, self.send_mentions_for_user, peer)
+
+    @timed("on_msg")
     def on_msg(self, *params):
         message = params[0].message
         sender_id = params[0].sender_uid
@@ -62,86 +140,265 @@ class Bot:
         service = params[0].message.serviceMessage.ext
         peer = params[0].peer
 
-        if service:
-            self.processing_service_message(service, sender_id, peer)
+        if service and not self.workers.submit(peer.id, self.processing_service_message, service, sender_id, peer):
+            print("Dropped service message in {}: handlers queue is full".format(peer.id))
         if not text:
             return
         if peer.type == 2:
             self.check_mention_in_message(message.textMessage, peer.id, params[0].mid)
-        else:
-
-            lang = self.get_lang(peer.id)
-            if text == self.commands["start"]:
-                if peer.id not in self.tracked_users:
-                    self.add_tracked_user(peer)
-                    self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.start', locale=lang))
-                else:
-                    self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.already', locale=lang))
-            elif text == self.commands["stop"]:
-                if peer.id in self.tracked_users:
-                    self.drop_remind(peer.id)
+        elif not self.workers.submit(peer.id, self.on_command, peer, text):
+            print("Dropped command from {}: handlers queue is full".format(peer.id))
+
+    def on_update(self, update):
+        kind = update.WhichOneof("update")
+        if kind in PROFILE_UPDATES:
+            self.profiles.pop(getattr(update, kind).uid)
+
+    @timed("on_command")
+    def on_command(self, peer, text):
+        if text == self.commands["start"]:
+            self.profiles.pop(peer.id)
+        lang = self.get_lang(peer.id)
+        if text == self.commands["start"]:
+            if peer.id not in self.tracked_users:
+                self.add_tracked_user(peer)
+                self.outbox.post(peer, self.phrases.t(PHRASES + '.start', locale=lang))
+            else:
+                self.outbox.post(peer, self.phrases.t(PHRASES + '.already', locale=lang))
+        elif text == self.commands["stop"]:
+            if peer.id in self.tracked_users:
+                self.drop_remind(peer.id)
+                self.mentions.clear(peer.id)
+                with self.state_lock:
+                    self.storage.remove_user(peer.id)
+                    for group_id in list(self.tracked_users[peer.id].groups):
+                        self.unsubscribe(peer.id, group_id)
                     self.tracked_users.pop(peer.id)
-                    self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.stop', locale=lang))
-                else:
-                    self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.not tracking', locale=lang))
-            elif text == self.commands["get_mentions"]:
-                if peer.id in self.tracked_users:
-                    self.send_mentions_for_user(peer)
-                    self.tracked_users[peer.id].mentions = {}
-                else:
-                    self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.not tracking opt', locale=lang)
-                                                    .format(self.commands["start"]))
-            elif text == self.commands["get_groups"]:
-                if peer.id in self.tracked_users:
-                    self.get_tracked_groups_for_user(peer)
-                else:
-                    self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.not tracking opt', locale=lang)
-                                                    .format(self.commands["start"]))
-            elif text == self.commands["set_reminder"]:
-                if peer.id in self.tracked_users:
-                    self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.set time', locale=lang),
-                                                    self.interactive_reminder(lang))
-                else:
-                    self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.not tracking opt', locale=lang)
-                                                    .format(self.commands["start"]))
-            elif text == self.commands["help"]:
-                self.get_commands(peer, lang)
+                self.outbox.post(peer, self.phrases.t(PHRASES + '.stop', locale=lang))
+            else:
+                self.outbox.post(peer, self.phrases.t(PHRASES + '.not tracking', locale=lang))
+        elif text == self.commands["get_mentions"]:
+            if peer.id in self.tracked_users:
+                self.send_mentions_for_user(peer, clear=True)
+            else:
+                self.outbox.post(peer, self.phrases.t(PHRASES + '.not tracking opt', locale=lang)
+                                 .format(self.commands["start"]))
+        elif text == self.commands["get_groups"]:
+            if peer.id in self.tracked_users:
+                self.get_tracked_groups_for_user(peer)
+            else:
+                self.outbox.post(peer, self.phrases.t(PHRASES + '.not tracking opt', locale=lang)
+                                 .format(self.commands["start"]))
+        elif text == self.commands["set_reminder"]:
+            if peer.id in self.tracked_users:
+                self.send_buttons(peer, self.phrases.t(PHRASES + '.set time', locale=lang),
+                                  self.interactive_reminder(lang))
             else:
-                self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.unknown', locale=lang)
-                                                .format(self.commands['help']))
+                self.outbox.post(peer, self.phrases.t(PHRASES + '.not tracking opt', locale=lang)
+                                 .format(self.commands["start"]))
+        elif text == self.commands["help"]:
+            self.get_commands(peer, lang)
+        else:
+            self.outbox.post(peer, self.phrases.t(PHRASES + '.unknown', locale=lang)
+                             .format(self.commands['help']))
 
+    @timed("on_event")
     def on_event(self, *params):
-        uid = params[0].uid
+        if not self.workers.submit(params[0].uid, self.on_click, params[0]):
+            print("Dropped button event from {}: handlers queue is full".format(params[0].uid))
+
+    @timed("on_click")
+    def on_click(self, event):
+        uid = event.uid
         peer = peers_pb2.Peer(type=peers_pb2.PEERTYPE_PRIVATE, id=uid)
-        which_button = params[0].value
-        msg = self.bot.messaging.get_messages_by_id([params[0].mid])[0]
+        which_button = event.value
+        mid = event.mid
         if which_button == "Start":
-            self.on_click_start(int(params[0].id), peer, msg)
+            self.on_click_start(int(event.id), peer, mid)
         elif which_button == "Stop":
-            self.on_click_stop(int(params[0].id), peer, msg)
-        elif params[0].id == "hours":
-            self.on_select(peer, params[0].mid, msg, which_button, "")
-        elif params[0].id == "minutes":
-            self.on_select(peer, params[0].mid, msg, "", which_button)
+            self.on_click_stop(int(event.id), peer, mid)
+        elif event.id == "hours":
+            self.on_select(peer, mid, which_button, "")
+        elif event.id == "minutes":
+            self.on_select(peer, mid, "", which_button)
 
     def get_commands(self, peer, lang):
-        text = i18n.t(PHRASES + '.commands', locale=lang).format(self.commands["start"], self.commands["stop"],
-                                                    self.commands["get_mentions"], self.commands["set_reminder"],
-                                                    self.commands["get_groups"])
-        return self.bot.messaging.send_message(peer, text)
+        self.outbox.post(peer, self.commands_text[lang])
 
-    def start(self):
+    def start(self, updates=None):
+        started = time.monotonic()
         self.preprocessing_from_database()
-        self.get_default_groups()
-        self.bot.messaging.on_message_async(self.on_msg, self.on_event)
+        self.mentions.start(sweep=self.shard == 0)
+        print("Startup: database loaded in {:.2f}s".format(time.monotonic() - started))
+        if self.metrics.enabled:
+            self.register_gauges()
+            self.metrics.serve()
+        started = time.monotonic()
+        snapshot_time = int(time.time())
+        self.load_groups_snapshot()
+        print("Startup: {0} groups restored from snapshot in {1:.2f}s".format(len(self.default_tracked_groups),
+                                                                              time.monotonic() - started))
+        if updates is None:
+            threading.Thread(target=self.bot.messaging.on_message, args=(self.on_msg, self.on_event, self.on_update),
+                             name="updates", daemon=True).start()
+        else:
+            threading.Thread(target=self.consume, args=(updates,), name="shard-updates", daemon=True).start()
+        if self.shard == 0:
+            threading.Thread(target=self.get_default_groups, name="groups-loader", daemon=True).start()
+            if self.members_resync:
+                threading.Thread(target=self.resync_members, name="members-resync", daemon=True).start()
+            threading.Thread(target=self.save_dirty_groups, name="groups-snapshot", daemon=True).start()
+        else:
+            threading.Thread(target=self.follow_groups_snapshot, args=(snapshot_time,), name="groups-snapshot",
+                             daemon=True).start()
         self.cron()
 
+    def consume(self, updates):
+        while True:
+            kind, update = updates.get()
+            try:
+                if kind == "msg":
+                    self.on_msg(update)
+                elif kind == "update":
+                    self.on_update(update)
+                else:
+                    self.on_event(update)
+            except Exception:
+                traceback.print_exc()
+
+    def register_gauges(self):
+        self.metrics.gauge("bot_tracked_users", lambda: len(self.tracked_users))
+        self.metrics.gauge("bot_groups", lambda: len(self.default_tracked_groups))
+        self.metrics.gauge("bot_reminders", lambda: len(self.reminder))
+        self.metrics.gauge("bot_reminder_minutes_caught_up", lambda: self.reminder.caught_up)
+        self.metrics.gauge("bot_mentions_pending", lambda: self.mentions.pending())
+        self.metrics.gauge("bot_mentions_flushed", lambda: self.mentions.flushed)
+        self.metrics.gauge("bot_mentions_expired", lambda: self.mentions.expired)
+        self.metrics.gauge("bot_mentions_trimmed", lambda: self.mentions.trimmed)
+        self.metrics.gauge("bot_profile_cache_hits", lambda: self.profiles.hits)
+        self.metrics.gauge("bot_profile_cache_misses", lambda: self.profiles.misses)
+        self.metrics.gauge("bot_handlers_queue_depth", lambda: self.workers.depth())
+        self.metrics.gauge("bot_handlers_dropped", lambda: self.workers.dropped)
+        self.metrics.gauge("bot_handlers_failed", lambda: self.workers.failed)
+        self.metrics.gauge("bot_delivery_queue_depth", lambda: self.delivery.depth())
+        self.metrics.gauge("bot_delivery_latency_max_seconds", lambda: self.delivery.latency_max)
+        self.metrics.gauge("bot_delivery_failed", lambda: self.delivery.failed)
+        self.metrics.gauge("bot_outbox_sent", lambda: self.outbox.sent)
+        self.metrics.gauge("bot_outbox_retried", lambda: self.outbox.retried)
+        self.metrics.gauge("bot_outbox_dropped", lambda: self.outbox.dropped)
+        self.metrics.gauge("bot_outbox_merged", lambda: self.outbox.merged)
+        self.metrics.gauge("bot_outbox_deferred", lambda: self.outbox.deferred)
+        self.metrics.gauge("bot_outbox_pending", lambda: self.outbox.pending())
+
     def get_default_groups(self):
+        started = time.monotonic()
         groups = self.get_groups()
+        print("Startup: {0} groups listed in {1:.2f}s".format(len(groups), time.monotonic() - started))
+        started = time.monotonic()
+        loaded, stale = [], set(self.default_tracked_groups)
+        with ThreadPoolExecutor(max_workers=self.startup_workers) as executor:
+            futures = {executor.submit(self.get_group, group): group for group in groups}
+            for future in as_completed(futures):
+                gid = futures[future].id
+                try:
+                    g = future.result()
+                except Exception as e:
+                    print("Failed to load group {0}: {1}".format(gid, e))
+                    stale.discard(gid)
+                    continue
+                if g is not None:
+                    stale.discard(gid)
+                    self.update_group(gid, g)
+                    loaded.append(g)
+        for gid in stale:
+            self.drop_group(gid)
+        if self.shard == 0:
+            self.storage.save_groups(loaded)
+        self.groups_loaded.set()
+        self.early_users.clear()
+        print("Startup: {0} groups loaded in {1:.2f}s".format(len(self.default_tracked_groups),
+                                                              time.monotonic() - started))
+
+    def load_groups_snapshot(self):
+        for gid, access_hash, title, shortname, invite_url, members, _ in self.storage.load_groups():
+            peer = peers_pb2.OutPeer(id=gid, type=peers_pb2.PEERTYPE_GROUP, access_hash=access_hash)
+            self.default_tracked_groups[gid] = Group(peer, IntSet.from_bytes(members), title, shortname, invite_url)
+
+    def follow_groups_snapshot(self, since):
+        ticker = threading.Event()
+        known = {row[0] for row in self.storage.load_group_ids()}
+        while not ticker.wait(self.snapshot_interval):
+            stamp = int(time.time())
+            for gid, access_hash, title, shortname, invite_url, members, _ in self.storage.load_groups(since):
+                peer = peers_pb2.OutPeer(id=gid, type=peers_pb2.PEERTYPE_GROUP, access_hash=access_hash)
+                self.update_group(gid, Group(peer, IntSet.from_bytes(members), title, shortname, invite_url))
+            if not self.groups_loaded.is_set():
+                self.groups_loaded.set()
+                self.early_users.clear()
+            gids = {row[0] for row in self.storage.load_group_ids()}
+            for gid in known - gids:
+                self.drop_group(gid)
+            known = gids
+            since = stamp
+
+    def drop_group(self, gid):
+        with self.state_lock:
+            self.default_tracked_groups.pop(gid, None)
+            uids = list(self.subscribers.get(gid, ()))
+            for uid in uids:
+                self.unsubscribe(uid, gid)
+            self.storage.remove_group_users(gid, uids)
+        self.mentions.clear_group(gid)
+        for lang in self.locales:
+            self.interactive.pop(("start", gid, lang), None)
+            self.interactive.pop(("stop", gid, lang), None)
+        if self.shard == 0:
+            self.storage.remove_groups([gid])
+
+    def update_group(self, gid, group):
+        with self.state_lock:
+            old = self.default_tracked_groups.get(gid)
+            self.default_tracked_groups[gid] = group
+            if old is None:
+                for uid in self.early_users:
+                    if uid in group.user_ids and uid in self.tracked_users and \
+                            gid not in self.tracked_users[uid].groups:
+                        self.subscribe(uid, gid)
+                        self.storage.add_user_groups(uid, [gid])
+                return
+        added, removed = old.user_ids.diff(group.user_ids)
+        for uid in added:
+            self.member_joined(gid, uid)
+        for uid in removed:
+            self.member_left(gid, uid)
+
+    def load_group(self, gid):
+        outpeer = self.bot.manager.get_outpeer(peers_pb2.Peer(type=peers_pb2.PEERTYPE_GROUP, id=gid))
+        groups = self.bot.internal.updates.GetReferencedEntitites(
+            sequence_and_updates_pb2.RequestGetReferencedEntitites(
+                groups=[peers_pb2.GroupOutPeer(group_id=gid, access_hash=outpeer.access_hash)]
+            )
+        ).groups
         for group in groups:
             g = self.get_group(group)
             if g is not None:
-                self.default_tracked_groups[group.id] = g
+                self.update_group(gid, g)
+                self.mark_dirty(gid)
+
+    def mark_dirty(self, gid):
+        if self.shard != 0:
+            return
+        with self.dirty_lock:
+            self.dirty_groups.add(gid)
+
+    def save_dirty_groups(self):
+        ticker = threading.Event()
+        while not ticker.wait(self.snapshot_interval):
+            with self.dirty_lock:
+                dirty, self.dirty_groups = self.dirty_groups, set()
+            groups = [self.default_tracked_groups[gid] for gid in dirty if gid in self.default_tracked_groups]
+            if groups:
+                self.storage.save_groups(groups)
 
     def get_group(self, group):
         peer = peers_pb2.OutPeer(id=group.id, type=peers_pb2.PEERTYPE_GROUP, access_hash=group.access_hash)
@@ -162,107 +419,239 @@ class Bot:
             )
         ).groups
 
+    @timed("check_mention_in_message")
     def check_mention_in_message(self, msg, gid, mid):
-        if msg.mentions:
-            for id_ in msg.mentions:
-                if id_ in self.tracked_users:
-                    self.add_mention(id_, gid, mid)
-                elif id_ == 0:
-                    for user_id in self.default_tracked_groups[gid].user_ids:
-                        if user_id in msg.mentions:
-                            continue
-                        self.add_mention(user_id, gid, mid)
+        if not msg.mentions:
+            return
+        subscribers = self.subscribers.get(gid)
+        if not subscribers:
+            return
+        mentions = set(msg.mentions)
+        if 0 in mentions:
+            recipients = set(subscribers)
+        else:
+            recipients = mentions & subscribers
+        for uid in recipients:
+            self.add_mention(uid, gid, mid)
 
     def add_mention(self, uid, gid, mid):
-        if gid not in self.tracked_users[uid].groups:
+        user = self.tracked_users.get(uid)
+        if user is None or gid not in user.groups:
             return
-        if gid in self.tracked_users[uid].mentions:
-            self.tracked_users[uid].mentions[gid].append(mid)
-        else:
-            self.tracked_users[uid].mentions[gid] = [mid]
+        self.mentions.add(uid, gid, mid)
+        if self.metrics.enabled:
+            self.metrics.inc("bot_mentions_total")
 
     def add_tracked_user(self, peer):
-        self.tracked_users[peer.id] = User(self.bot.manager.get_outpeer(peer), self.get_default_groups_for_user(peer))
-        for group_id in self.tracked_users[peer.id].groups:
-            self.cursor.execute("INSERT INTO users values (?, ?)", [peer.id, group_id])
-            self.connect.commit()
+        outpeer = self.bot.manager.get_outpeer(peer)
+        with self.state_lock:
+            self.tracked_users[peer.id] = User(outpeer, IntSet())
+            if not self.groups_loaded.is_set():
+                self.early_users.add(peer.id)
+            groups = self.get_default_groups_for_user(peer)
+            for group_id in groups:
+                self.subscribe(peer.id, group_id)
+            self.storage.add_user_groups(peer.id, groups)
+
+    def subscribe(self, uid, gid):
+        with self.state_lock:
+            self.tracked_users[uid].groups.add(gid)
+            if gid in self.subscribers:
+                self.subscribers[gid].add(uid)
+            else:
+                self.subscribers[gid] = {uid}
+
+    def unsubscribe(self, uid, gid):
+        with self.state_lock:
+            self.tracked_users[uid].groups.discard(gid)
+            if gid in self.subscribers:
+                self.subscribers[gid].discard(uid)
+                if not self.subscribers[gid]:
+                    self.subscribers.pop(gid)
 
     def get_default_groups_for_user(self, peer):
         result = set()
-        for id_, group in self.default_tracked_groups.items():
+        for id_, group in list(self.default_tracked_groups.items()):
             if peer.id in group.user_ids:
                 result.add(id_)
         return result
 
     def get_tracked_groups_for_user(self, peer):
         lang = self.get_lang(peer.id)
-        while self.tracked_users[peer.id].buttons_mids:
-            message = self.bot.messaging.get_messages_by_id([self.tracked_users[peer.id].buttons_mids.pop()])[0]
-            self.bot.messaging.update_message(message, message.message.textMessage.text)
-        for id_, group in self.default_tracked_groups.items():
+        self.remove_buttons(peer.id, [definitions_pb2.UUIDValue(msb=msb, lsb=lsb)
+                                      for msb, lsb in self.tracked_users[peer.id].buttons_mids])
+        self.tracked_users[peer.id].buttons_mids = []
+        for id_, group in list(self.default_tracked_groups.items()):
             if peer.id not in group.user_ids:
                 continue
             if id_ in self.tracked_users[peer.id].groups:
                 interactive = self.interactive_stop(id_, lang)
             else:
                 interactive = self.interactive_start(id_, lang)
-            self.tracked_users[peer.id].buttons_mids.append(
-                self.bot.messaging.send_message(peer, self.get_shortname_or_url_group(group), interactive).message_id)
+            self.send_buttons(peer, self.get_shortname_or_url_group(group), interactive, track=True)
 
-    @staticmethod
-    def interactive_stop(gid, lang):
-        return [interactive_media.InteractiveMediaGroup(
-            [
-                interactive_media.InteractiveMedia(
-                    gid,
-                    interactive_media.InteractiveMediaButton("Stop", i18n.t(MEDIA + '.stop tracking', locale=lang))
-                ),
-            ]
-        )]
+    def send_buttons(self, peer, text, interactive, track=False):
+        self.outbox.send_message(peer, text, interactive, functools.partial(self.buttons_sent, peer.id, text, track))
 
-    @staticmethod
-    def interactive_start(gid, lang):
-        return [interactive_media.InteractiveMediaGroup(
-            [
-                interactive_media.InteractiveMedia(
-                    gid,
-                    interactive_media.InteractiveMediaButton("Start", i18n.t(MEDIA + '.start tracking', locale=lang))
-                ),
-            ]
-        )]
+    def buttons_sent(self, uid, text, track, result):
+        mid = result.message_id
+        self.buttons.set((mid.msb, mid.lsb), text)
+        user = self.tracked_users.get(uid)
+        if track and user is not None:
+            user.buttons_mids.append((mid.msb, mid.lsb))
 
-    @staticmethod
-    def interactive_reminder(lang):
+    def remove_buttons(self, uid, mids):
+        peer = peers_pb2.Peer(type=peers_pb2.PEERTYPE_PRIVATE, id=uid)
+        missed = []
+        for mid in mids:
+            text = self.buttons.pop((mid.msb, mid.lsb))
+            if text is None:
+                missed.append(mid)
+                continue
+            self.outbox.update_message(SimpleNamespace(mid=mid, peer=peer), text)
+        if missed:
+            self.delivery.submit(uid, self.strip_buttons, peer, missed)
+
+    def strip_buttons(self, peer, mids):
+        for message in self.outbox.get_messages_by_id(mids):
+            self.outbox.update_message(SimpleNamespace(mid=message.mid, peer=peer), message.message.textMessage.text)
+
+    def forget_buttons(self, uid, mid):
+        if uid in self.tracked_users and (mid.msb, mid.lsb) in self.tracked_users[uid].buttons_mids:
+            self.tracked_users[uid].buttons_mids.remove((mid.msb, mid.lsb))
+        self.remove_buttons(uid, [mid])
+
+    def interactive_stop(self, gid, lang):
+        key = ("stop", gid, lang)
+        if key not in self.interactive:
+            self.interactive[key] = [interactive_media.InteractiveMediaGroup(
+                [
+                    interactive_media.InteractiveMedia(
+                        gid,
+                        interactive_media.InteractiveMediaButton("Stop", self.phrases.t(MEDIA + '.stop tracking',
+                                                                                        locale=lang))
+                    ),
+                ]
+            )]
+        return self.interactive[key]
+
+    def interactive_start(self, gid, lang):
+        key = ("start", gid, lang)
+        if key not in self.interactive:
+            self.interactive[key] = [interactive_media.InteractiveMediaGroup(
+                [
+                    interactive_media.InteractiveMedia(
+                        gid,
+                        interactive_media.InteractiveMediaButton("Start", self.phrases.t(MEDIA + '.start tracking',
+                                                                                         locale=lang))
+                    ),
+                ]
+            )]
+        return self.interactive[key]
+
+    def interactive_reminder(self, lang):
+        key = ("reminder", lang)
+        if key not in self.interactive:
+            self.interactive[key] = self.build_interactive_reminder(lang)
+        return self.interactive[key]
+
+    def build_interactive_reminder(self, lang):
         return [interactive_media.InteractiveMediaGroup(
             [
                 interactive_media.InteractiveMedia(
                     "hours",
-                    interactive_media.InteractiveMediaSelect(HOURS, i18n.t(MEDIA + '.hour', locale=lang),
-                                                             i18n.t(MEDIA + '.hour', locale=lang))
+                    interactive_media.InteractiveMediaSelect(HOURS, self.phrases.t(MEDIA + '.hour', locale=lang),
+                                                             self.phrases.t(MEDIA + '.hour', locale=lang))
                 ),
                 interactive_media.InteractiveMedia(
                     "minutes",
-                    interactive_media.InteractiveMediaSelect(MINUTES, i18n.t(MEDIA + '.minute', locale=lang),
-                                                             i18n.t(MEDIA + '.minute', locale=lang))
+                    interactive_media.InteractiveMediaSelect(MINUTES, self.phrases.t(MEDIA + '.minute', locale=lang),
+                                                             self.phrases.t(MEDIA + '.minute', locale=lang))
                 ),
             ]
         )]
 
     def get_user_ids_in_group(self, peer):
-        members = self.bot.groups.load_members(peer, GROUPS_MEMBERS_FETCH_LIMIT)
-        users = set()
-        for member in members.users:
-            users.add(member.id)
-        return users
-
-    def send_mentions_for_user(self, peer):
-        user = self.tracked_users[peer.id]
+        group_peer = peers_pb2.GroupOutPeer(group_id=peer.id, access_hash=peer.access_hash)
+        ids = array("i")
+        next_ = None
+        while True:
+            members = self.bot.internal.groups.LoadMembers(
+                groups_pb2.RequestLoadMembers(group=group_peer, limit=GROUPS_MEMBERS_FETCH_LIMIT, next=next_)
+            )
+            ids.extend(member.uid for member in members.members)
+            if not members.HasField("cursor") or not members.cursor.value:
+                break
+            next_ = members.cursor
+        return IntSet(ids)
+
+    def resync_members(self):
+        self.groups_loaded.wait()
+        ticker = threading.Event()
+        while True:
+            groups = list(self.default_tracked_groups.items())
+            if not groups:
+                ticker.wait(self.members_resync)
+                continue
+            for gid, group in groups:
+                ticker.wait(self.members_resync / len(groups))
+                if gid not in self.default_tracked_groups:
+                    continue
+                try:
+                    self.resync_group(gid, group)
+                except Exception as e:
+                    print("Failed to resync members of group {0}: {1}".format(gid, e))
+
+    def resync_group(self, gid, group):
+        roster = self.get_user_ids_in_group(group.peer)
+        self.update_group(gid, Group(group.peer, roster, group.title, group.shortname, group.invite_url))
+        self.mark_dirty(gid)
+
+    @timed("send_mentions_for_user")
+    def send_mentions_for_user(self, peer, clear=False):
+        if peer.id not in self.tracked_users:
+            return
         lang = self.get_lang(peer.id)
-        if not user.mentions:
-            self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.no mentions', locale=lang))
-        for group_id, mids in user.mentions.items():
-            group = self.default_tracked_groups[group_id]
-            self.bot.messaging.forward(peer, mids, self.get_shortname_or_url_group(group))
+        if clear:
+            mentions, overflow = self.mentions.pop(peer.id)
+        else:
+            mentions, overflow = self.mentions.get(peer.id)
+        if not mentions:
+            self.outbox.send_message(peer, self.phrases.t(PHRASES + '.no mentions', locale=lang))
+            return
+        if self.digest:
+            self.send_digest(peer, mentions, overflow, lang)
+            return
+        for group_id, mids in mentions.items():
+            group = self.default_tracked_groups.get(group_id)
+            if group is None:
+                continue
+            text = self.get_shortname_or_url_group(group)
+            more = overflow.get(group_id, 0) + max(0, len(mids) - self.max_forward)
+            if more:
+                text += "\n" + self.phrases.t(PHRASES + '.more mentions', locale=lang).format(more, text)
+                mids = mids[-self.max_forward:]
+            if mids:
+                self.outbox.forward(peer, mids, text)
+            else:
+                self.outbox.send_message(peer, text)
+
+    def send_digest(self, peer, mentions, overflow, lang):
+        lines = [self.phrases.t(PHRASES + '.digest', locale=lang)]
+        forward = []
+        for group_id, mids in mentions.items():
+            group = self.default_tracked_groups.get(group_id)
+            if group is None:
+                continue
+            lines.append(self.phrases.t(PHRASES + '.digest group', locale=lang).format(
+                self.get_shortname_or_url_group(group), len(mids) + overflow.get(group_id, 0)))
+            forward.extend(mids[-self.max_forward:])
+        if len(forward) > self.max_forward:
+            forward = forward[-self.max_forward:]
+        if forward:
+            self.outbox.forward(peer, forward, "\n".join(lines))
+        elif len(lines) > 1:
+            self.outbox.send_message(peer, "\n".join(lines))
 
     @staticmethod
     def get_shortname_or_url_group(group):
@@ -272,56 +661,56 @@ class Bot:
             text = "[{0}]({1})".format(group.title, group.invite_url)
         return text
 
-    def on_click_start(self, event_id, peer, msg):
+    def on_click_start(self, event_id, peer, mid):
         uid = peer.id
-        text = msg.message.textMessage.text
         lang = self.get_lang(uid)
         if uid not in self.tracked_users:
-            self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.oops', locale=lang).format(self.commands["start"]))
-            self.bot.messaging.update_message(msg, text)
+            self.outbox.post(peer, self.phrases.t(PHRASES + '.oops', locale=lang).format(self.commands["start"]))
+            self.forget_buttons(uid, mid)
             return
         group = self.default_tracked_groups[event_id]
-        if event_id not in self.tracked_users[uid].groups:
-            self.tracked_users[uid].groups.add(event_id)
-            self.cursor.execute("INSERT INTO users values (?, ?)", [peer.id, event_id])
-            self.connect.commit()
-            self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.start group', locale=lang).format(
+        with self.state_lock:
+            subscribed = event_id not in self.tracked_users[uid].groups
+            if subscribed:
+                self.subscribe(uid, event_id)
+                self.storage.add_user_groups(uid, [event_id])
+        if subscribed:
+            self.outbox.post(peer, self.phrases.t(PHRASES + '.start group', locale=lang).format(
                 self.get_shortname_or_url_group(group)
             ))
         else:
-            self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.already group', locale=lang))
-        self.bot.messaging.update_message(msg, text)
+            self.outbox.post(peer, self.phrases.t(PHRASES + '.already group', locale=lang))
+        self.forget_buttons(uid, mid)
 
-    def on_click_stop(self, event_id, peer, msg):
+    def on_click_stop(self, event_id, peer, mid):
         uid = peer.id
-        text = msg.message.textMessage.text
         lang = self.get_lang(uid)
         if uid not in self.tracked_users:
-            self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.oops', locale=lang).format(self.commands["start"]))
-            self.bot.messaging.update_message(msg, text)
+            self.outbox.post(peer, self.phrases.t(PHRASES + '.oops', locale=lang).format(self.commands["start"]))
+            self.forget_buttons(uid, mid)
             return
         group = self.default_tracked_groups[event_id]
-        if event_id in self.tracked_users[uid].groups:
-            self.tracked_users[uid].groups.remove(event_id)
-            self.cursor.execute("DELETE FROM users WHERE uid={0} and gid={1}".format(uid, event_id))
-            self.connect.commit()
-            self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.stop group', locale=lang).format(
+        with self.state_lock:
+            unsubscribed = event_id in self.tracked_users[uid].groups
+            if unsubscribed:
+                self.unsubscribe(uid, event_id)
+                self.storage.remove_user_group(uid, event_id)
+        if unsubscribed:
+            self.outbox.post(peer, self.phrases.t(PHRASES + '.stop group', locale=lang).format(
                 self.get_shortname_or_url_group(group)
             ))
         else:
-            self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.not trackind group', locale=lang).format(
+            self.outbox.post(peer, self.phrases.t(PHRASES + '.not trackind group', locale=lang).format(
                 self.get_shortname_or_url_group(group)
             ))
-        self.bot.messaging.update_message(msg, text)
+        self.forget_buttons(uid, mid)
 
-    def on_select(self, peer, mid, msg, hour, minute):
+    def on_select(self, peer, mid, hour, minute):
         uid = peer.id
-        text = msg.message.textMessage.text
-        lang = self.get_lang(uid)
-        timezone = self.get_timezone(uid)
+        lang, timezone = self.get_profile(uid)
         if uid not in self.tracked_users:
-            self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.oops', locale=lang).format(self.commands["start"]))
-            self.bot.messaging.update_message(msg, text)
+            self.outbox.post(peer, self.phrases.t(PHRASES + '.oops', locale=lang).format(self.commands["start"]))
+            self.remove_buttons(uid, [mid])
             return
         for remind in self.tracked_users[uid].reminder:
             if mid == remind[0]:
@@ -339,110 +728,123 @@ class Bot:
                     time = "{0}:{1}".format(hour, minute)
                     utc_time = self.get_utc_time(hour, minute, timezone)
 
-                    if utc_time in self.reminder:
-                        self.reminder[utc_time].append(uid)
-                    else:
-                        self.reminder[utc_time] = [uid]
-
-                    for reminder in self.tracked_users[uid].reminder:
-                        mid = reminder[0]
-                        message = self.bot.messaging.get_messages_by_id([mid])[0]
-                        self.bot.messaging.update_message(message, message.message.textMessage.text)
+                    self.remove_buttons(uid, [reminder[0] for reminder in self.tracked_users[uid].reminder])
                     self.tracked_users[uid].reminder = []
-                    self.drop_remind(uid)
-                    self.cursor.execute("INSERT INTO reminder values (?, ?)", [utc_time, uid])
-                    self.connect.commit()
-                    self.tracked_users[uid].remind_time = utc_time
-                    self.bot.messaging.update_message(msg, text)
-                    self.bot.messaging.send_message(peer, i18n.t(PHRASES + '.remind', locale=lang).format(time))
+                    self.add_remind(uid, utc_time)
+                    self.outbox.post(peer, self.phrases.t(PHRASES + '.remind', locale=lang).format(time))
                 elif hour:
                     remind[1] = "0" * (2 - len(hour)) + hour
                 else:
                     remind[2] = "0" * (2 - len(minute)) + minute
                 return
-        self.tracked_users[uid].reminder.append((mid, hour, minute))
+        self.tracked_users[uid].reminder.append([mid, hour, minute])
 
     def processing_service_message(self, service_msg, sender_id, peer):
-        _type = str(service_msg).split(' ')[0]
-        if "userKicked" == _type:
-            kick = service_msg.userKicked.kicked_uid
-            if kick == self.bot.user_info.user.id:
-                self.default_tracked_groups.pop(peer.id)
-            else:
-                if kick in self.default_tracked_groups[peer.id].user_ids:
-                    self.default_tracked_groups[peer.id].user_ids.remove(kick)
-                if kick in self.tracked_users and peer.id in self.tracked_users[kick].groups:
-                    self.tracked_users[kick].groups.remove(peer.id)
-        elif 'userJoined' == _type:
-            if peer.id in self.default_tracked_groups:
-                self.default_tracked_groups[peer.id].user_ids.add(sender_id)
-                if sender_id in self.tracked_users:
-                    self.tracked_users[sender_id].groups.add(peer.id)
-            else:
-                groups = self.get_groups()
-                for group in groups:
-                    if group.id == peer.id:
-                        self.default_tracked_groups[peer.id] = self.get_group(group)
-        elif 'userLeft' == _type:
-            if sender_id in self.tracked_users:
-                if peer.id in self.tracked_users[sender_id].groups:
-                    self.tracked_users[sender_id].groups.remove(sender_id)
-                if sender_id in self.default_tracked_groups[peer.id].users:
-                    self.default_tracked_groups[peer.id].users.remove(sender_id)
+        handler = self.service_handlers.get(service_msg.WhichOneof(SERVICE_BODY))
+        if handler is not None:
+            handler(service_msg, sender_id, peer.id)
+
+    def on_user_invited(self, service_msg, sender_id, gid):
+        self.on_user_joined(service_msg, service_msg.userInvited.invited_uid, gid)
+
+    def on_user_joined(self, service_msg, uid, gid):
+        if gid in self.default_tracked_groups:
+            self.member_joined(gid, uid)
+        elif self.groups_loaded.is_set():
+            self.load_group(gid)
+
+    def on_user_kicked(self, service_msg, sender_id, gid):
+        self.on_user_left(service_msg, service_msg.userKicked.kicked_uid, gid)
+
+    def on_user_left(self, service_msg, uid, gid):
+        if uid == self.bot.user_info.user.id:
+            self.drop_group(gid)
+        elif gid in self.default_tracked_groups:
+            self.member_left(gid, uid)
+
+    def on_changed_title(self, service_msg, sender_id, gid):
+        with self.state_lock:
+            group = self.default_tracked_groups.get(gid)
+            if group is None:
+                return
+            group.title = service_msg.changedTitle.title
+        self.mark_dirty(gid)
+
+    def member_joined(self, gid, uid):
+        with self.state_lock:
+            group = self.default_tracked_groups.get(gid)
+            if group is None:
+                return
+            group.user_ids.add(uid)
+            if uid in self.tracked_users and gid not in self.tracked_users[uid].groups:
+                self.subscribe(uid, gid)
+                self.storage.add_user_groups(uid, [gid])
+        self.mark_dirty(gid)
+
+    def member_left(self, gid, uid):
+        with self.state_lock:
+            group = self.default_tracked_groups.get(gid)
+            if group is None:
+                return
+            group.user_ids.discard(uid)
+            if uid in self.tracked_users and gid in self.tracked_users[uid].groups:
+                self.unsubscribe(uid, gid)
+                self.storage.remove_user_group(uid, gid)
+        self.mark_dirty(gid)
 
     def preprocessing_from_database(self):
-        try:
-            self.cursor.execute("CREATE TABLE users (uid integer, gid integer)")
-            self.connect.commit()
-        except:
-            print("Table 'users' already exist")
-            self.cursor.execute("SELECT * FROM users")
-            users = self.cursor.fetchall()
-            for user in users:
-                if user[0] not in self.tracked_users:
-                    peer = peers_pb2.Peer(type=peers_pb2.PEERTYPE_PRIVATE, id=user[0])
-                    self.tracked_users[user[0]] = User(self.bot.manager.get_outpeer(peer),
-                                                       [user[1]])
-                else:
-                    self.tracked_users[user[0]].groups.append(user[1])
-        try:
-            self.cursor.execute("CREATE TABLE reminder (time text, uid integer)")
-            self.connect.commit()
-        except:
-            print("Table 'reminder' already exist")
-            self.cursor.execute("SELECT * FROM reminder")
-            reminder = self.cursor.fetchall()
-            for remind in reminder:
-                if remind[0] in self.reminder:
-                    self.reminder[remind[0]].append(remind[1])
-                else:
-                    self.reminder[remind[0]] = [remind[1]]
-                self.tracked_users[remind[1]].remind_time = remind[0]
+        version = self.storage.migrate()
+        print("Database schema migrated from version {}".format(version))
+        for user in self.storage.load_users(self.shard, self.shards):
+            if user[0] not in self.tracked_users:
+                peer = peers_pb2.Peer(type=peers_pb2.PEERTYPE_PRIVATE, id=user[0])
+                self.tracked_users[user[0]] = User(self.bot.manager.get_outpeer(peer), IntSet())
+            self.subscribe(user[0], user[1])
+        for remind in self.storage.load_reminders(self.shard, self.shards):
+            if remind[1] not in self.tracked_users:
+                continue
+            self.reminder.add(remind[0], remind[1])
+            self.tracked_users[remind[1]].remind_times.append(remind[0])
+
+    def add_remind(self, uid, utc_time):
+        remind_times = self.tracked_users[uid].remind_times
+        if utc_time in remind_times:
+            return
+        remind_times.append(utc_time)
+        self.reminder.add(utc_time, uid)
+        self.storage.add_reminder(uid, utc_time)
+        while len(remind_times) > self.max_reminders:
+            last_time = remind_times.pop(0)
+            self.reminder.remove(last_time, uid)
+            self.storage.remove_reminder(uid, last_time)
 
     def drop_remind(self, uid):
-        if self.tracked_users[uid].remind_time is not None:
-            last_time = self.tracked_users[uid].remind_time
-            if uid in self.reminder[last_time]:
-                self.reminder[last_time].remove(uid)
-                self.cursor.execute("DELETE FROM reminder WHERE uid={}".format(uid))
-                self.connect.commit()
-                if not self.reminder[last_time]:
-                    self.reminder.pop(last_time)
+        for last_time in self.tracked_users[uid].remind_times:
+            self.reminder.remove(last_time, uid)
+        self.tracked_users[uid].remind_times = []
+        self.storage.remove_reminders(uid)
+
+    def get_profile(self, uid):
+        profile = self.profiles.get(uid)
+        if profile is None:
+            user = self.bot.users.get_user_by_id(uid)
+            locales = user.data.locales
+            if not locales or locales[0] not in LOCALES:
+                lang = self.locale
+            else:
+                lang = locales[0]
+            timezone = user.data.time_zone
+            if not timezone:
+                timezone = self.timezone
+            profile = (lang, timezone)
+            self.profiles.set(uid, profile)
+        return profile
 
     def get_lang(self, uid):
-        user = self.bot.users.get_user_by_id(uid)
-        locales = user.data.locales
-        if not locales or locales[0] not in LOCALES:
-            return self.locale
-        else:
-            return locales[0]
+        return self.get_profile(uid)[0]
 
     def get_timezone(self, uid):
-        user = self.bot.users.get_user_by_id(uid)
-        timezone = user.data.time_zone
-        if not timezone:
-            timezone = self.timezone
-        return timezone
+        return self.get_profile(uid)[1]
 
     @staticmethod
     def get_utc_time(hour, minute, timezone):
@@ -0,0 +1,61 @@
+from array import array
+from bisect import bisect_left
+
+
+class IntSet:
+    __slots__ = ("ids",)
+
+    def __init__(self, ids=()):
+        self.ids = array("i", sorted(set(ids)))
+
+    def __contains__(self, uid):
+        i = bisect_left(self.ids, uid)
+        return i < len(self.ids) and self.ids[i] == uid
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_bytes(cls, data):
+        roster = cls()
+        roster.ids.frombytes(data)
+        return roster
+
+    def to_bytes(self):
+        return self.ids.tobytes()
+
+    def add(self, uid):
+        i = bisect_left(self.ids, uid)
+        if i == len(self.ids) or self.ids[i] != uid:
+            self.ids.insert(i, uid)
+
+    def discard(self, uid):
+        i = bisect_left(self.ids, uid)
+        if i < len(self.ids) and self.ids[i] == uid:
+            del self.ids[i]
+
+    def remove(self, uid):
+        if uid not in self:
+            raise KeyError(uid)
+        self.discard(uid)
+
+    def diff(self, other):
+        added, removed = [], []
+        i, j = 0, 0
+        old, new = self.ids, other.ids
+        while i < len(old) and j < len(new):
+            if old[i] == new[j]:
+                i += 1
+                j += 1
+            elif old[i] < new[j]:
+                removed.append(old[i])
+                i += 1
+            else:
+                added.append(new[j])
+                j += 1
+        removed.extend(old[i:])
+        added.extend(new[j:])
+        return added, removed
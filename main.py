@@ -1,6 +1,7 @@
 import i18n
 
 from bot import Bot
+from shard import start_sharded
 import os
 import yaml
 
@@ -28,7 +29,10 @@ if __name__ == '__main__':
     with open(os.path.dirname(__file__) + '/config.yml') as f:
         config = yaml.load(f, Loader=yaml.FullLoader)
     config_validate(config)
-    bot = Bot(config)
+    if config.get("shards", 1) > 1:
+        start_sharded(config)
+    else:
+        bot = Bot(config)
 
-    bot.start()
+        bot.start()
 
@@ -0,0 +1,165 @@
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from dialog_api import definitions_pb2
+
+FLUSH_INTERVAL = 1
+BATCH_SIZE = 500
+MAX_PER_USER = 1000
+MAX_PER_GROUP = 100
+MAX_AGE = 7 * 24 * 60 * 60
+SWEEP_INTERVAL = 300
+SWEEP_BATCH = 100
+MIN_UID = -(1 << 63)
+
+
+class MentionStore:
+    def __init__(self, storage, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE, max_per_user=MAX_PER_USER,
+                 max_per_group=MAX_PER_GROUP, max_age=MAX_AGE, sweep_interval=SWEEP_INTERVAL, sweep_batch=SWEEP_BATCH):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_per_user = max_per_user
+        self.max_per_group = max_per_group
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.flushed = 0
+        self.expired = 0
+        self.trimmed = 0
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def start(self, sweep=True):
+        threading.Thread(target=self._run, name="mentions-flusher", daemon=True).start()
+        if sweep and self.sweep_interval and (self.max_per_user or self.max_per_group or self.max_age):
+            threading.Thread(target=self._sweep, name="mentions-sweeper", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    def add(self, uid, gid, mid):
+        with self._pending_lock:
+            self._pending.append((uid, gid, mid.msb, mid.lsb, int(time.time())))
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        pending = []
+        try:
+            with self.storage.transaction() as connect:
+                with self._pending_lock:
+                    pending, self._pending = self._pending, []
+                if pending:
+                    connect.executemany("INSERT OR IGNORE INTO mentions values (?, ?, ?, ?, ?)", pending)
+        except Exception:
+            with self._pending_lock:
+                self._pending[:0] = pending
+            raise
+        self.flushed += len(pending)
+
+    def get(self, uid):
+        self.flush()
+        with self.storage.transaction() as connect:
+            rows = connect.execute("SELECT rowid, gid, msb, lsb FROM mentions WHERE uid = ? ORDER BY rowid",
+                                   [uid]).fetchall()
+            overflow = connect.execute("SELECT gid, count FROM mentions_overflow WHERE uid = ?", [uid]).fetchall()
+        return self._group(rows, overflow)
+
+    def pop(self, uid):
+        self.flush()
+        with self.storage.transaction() as connect:
+            rows = connect.execute("SELECT rowid, gid, msb, lsb FROM mentions WHERE uid = ? ORDER BY rowid",
+                                   [uid]).fetchall()
+            overflow = connect.execute("SELECT gid, count FROM mentions_overflow WHERE uid = ?", [uid]).fetchall()
+            if rows:
+                connect.execute("DELETE FROM mentions WHERE uid = ? AND rowid <= ?", [uid, rows[-1][0]])
+            if overflow:
+                connect.execute("DELETE FROM mentions_overflow WHERE uid = ?", [uid])
+        return self._group(rows, overflow)
+
+    def clear(self, uid):
+        self.flush()
+        with self.storage.transaction() as connect:
+            connect.execute("DELETE FROM mentions WHERE uid = ?", [uid])
+            connect.execute("DELETE FROM mentions_overflow WHERE uid = ?", [uid])
+
+    def clear_group(self, gid):
+        self.flush()
+        with self.storage.transaction() as connect:
+            connect.execute("DELETE FROM mentions WHERE gid = ?", [gid])
+            connect.execute("DELETE FROM mentions_overflow WHERE gid = ?", [gid])
+
+    def _sweep(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                traceback.print_exc()
+
+    def sweep(self):
+        last = MIN_UID
+        while True:
+            cutoff = int(time.time()) - self.max_age
+            with self.storage.transaction() as connect:
+                uids = [row[0] for row in connect.execute(
+                    "SELECT DISTINCT uid FROM mentions WHERE uid > ? ORDER BY uid LIMIT ?", [last, self.sweep_batch])]
+                for uid in uids:
+                    self._trim(connect, uid, cutoff)
+            if len(uids) < self.sweep_batch:
+                return
+            last = uids[-1]
+
+    def _trim(self, connect, uid, cutoff):
+        rows = connect.execute("SELECT rowid, gid, time FROM mentions WHERE uid = ? ORDER BY rowid DESC", [uid])
+        kept = 0
+        per_group = {}
+        overflow = {}
+        removed = []
+        for rowid, gid, created in rows:
+            if self.max_age and created < cutoff:
+                removed.append((rowid,))
+                self.expired += 1
+                continue
+            per_group[gid] = per_group.get(gid, 0) + 1
+            if (self.max_per_group and per_group[gid] > self.max_per_group) or \
+                    (self.max_per_user and kept >= self.max_per_user):
+                removed.append((rowid,))
+                overflow[gid] = overflow.get(gid, 0) + 1
+                self.trimmed += 1
+                continue
+            kept += 1
+        if removed:
+            connect.executemany("DELETE FROM mentions WHERE rowid = ?", removed)
+        if overflow:
+            connect.executemany("INSERT INTO mentions_overflow values (?, ?, ?) ON CONFLICT (uid, gid) "
+                                "DO UPDATE SET count = count + excluded.count",
+                                [(uid, gid, count) for gid, count in overflow.items()])
+
+    @staticmethod
+    def _group(rows, overflow):
+        groups = OrderedDict()
+        for _, gid, msb, lsb in rows:
+            if gid not in groups:
+                groups[gid] = OrderedDict()
+            groups[gid][(msb, lsb)] = None
+        result = OrderedDict()
+        for gid, mids in groups.items():
+            result[gid] = [definitions_pb2.UUIDValue(msb=msb, lsb=lsb) for msb, lsb in mids]
+        for gid, _ in overflow:
+            result.setdefault(gid, [])
+        return result, dict(overflow)
@@ -0,0 +1,143 @@
+import functools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROXIED = ("messaging", "groups", "users", "internal", "updates", "manager")
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(k, v) for k, v in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(BUCKETS) and value > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self, enabled=False, host="127.0.0.1", port=8080):
+        self.enabled = enabled
+        self.host = host
+        self.port = port
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append("{0}{1} {2}".format(name, format_labels(labels), value))
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append("{0}_bucket{1} {2}".format(name, format_labels(labels, [("le", bound)]), cumulative))
+                lines.append("{0}_sum{1} {2}".format(name, format_labels(labels), histogram.sum))
+                lines.append("{0}_count{1} {2}".format(name, format_labels(labels), histogram.count))
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                lines.append("{0} {1}".format(name, fn()))
+            except Exception as e:
+                print("Failed to collect gauge {0}: {1}".format(name, e))
+        return "\n".join(lines) + "\n"
+
+    def serve(self):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((self.host, self.port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+    def instrument(self, target, prefix):
+        if not self.enabled:
+            return target
+        return RpcProxy(target, self, prefix)
+
+
+class RpcProxy:
+    def __init__(self, target, metrics, prefix):
+        self._target = target
+        self._metrics = metrics
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        method = "{0}.{1}".format(self._prefix, name)
+        if name in PROXIED:
+            return RpcProxy(attr, self._metrics, method)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            except Exception:
+                self._metrics.inc("bot_rpc_errors_total", method=method)
+                raise
+            finally:
+                self._metrics.inc("bot_rpc_total", method=method)
+                self._metrics.observe("bot_rpc_seconds", time.perf_counter() - started, method=method)
+        return call
+
+
+def timed(handler):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            if not self.metrics.enabled:
+                return fn(self, *args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(self, *args, **kwargs)
+            finally:
+                self.metrics.observe("bot_handler_seconds", time.perf_counter() - started, handler=handler)
+        return wrapper
+    return decorator
@@ -0,0 +1,174 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from collections import deque
+
+import grpc
+
+from cache import LRUCache
+from ratelimit import TokenBucket
+
+RETRY_CODES = (grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.UNAVAILABLE)
+PEER_BUCKETS = 100000
+RATE = 20
+
+
+class Outbox:
+    def __init__(self, messaging, pool, rate=RATE, peer_rate=1, peer_burst=5, retries=3, backoff=1.0, max_pending=20):
+        self.messaging = messaging
+        self.pool = pool
+        self.bucket = TokenBucket(rate)
+        self.peer_rate = peer_rate
+        self.peer_burst = peer_burst
+        self.peer_buckets = LRUCache(PEER_BUCKETS)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_pending = max_pending
+        self.sent = 0
+        self.retried = 0
+        self.dropped = 0
+        self.merged = 0
+        self.deferred = 0
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._timers = []
+        self._timers_seq = itertools.count()
+        self._timers_ready = threading.Condition()
+        threading.Thread(target=self._run_timers, name="outbox-timers", daemon=True).start()
+
+    def peer_bucket(self, peer):
+        if not self.peer_rate:
+            return None
+        bucket = self.peer_buckets.get(peer.id)
+        if bucket is None:
+            bucket = TokenBucket(self.peer_rate, self.peer_burst)
+            self.peer_buckets.set(peer.id, bucket)
+        return bucket
+
+    def enqueue(self, peer, fn, args, callback=None):
+        with self._lock:
+            queue = self._queues.get(peer.id)
+            idle = queue is None
+            if idle:
+                queue = self._queues[peer.id] = deque()
+            queue.append([fn, args, callback, 0])
+        if idle:
+            self.pool.submit(peer.id, self.drain, peer)
+
+    def drain(self, peer):
+        bucket = self.peer_bucket(peer)
+        while True:
+            with self._lock:
+                queue = self._queues[peer.id]
+                if not queue:
+                    del self._queues[peer.id]
+                    return
+                if bucket is not None and not bucket.acquire(block=False):
+                    self.deferred += 1
+                    delay = bucket.delay()
+                else:
+                    delay = None
+                    job = queue.popleft()
+            if delay is not None:
+                self.schedule(delay, peer)
+                return
+            fn, args, callback, attempt = job
+            self.bucket.acquire()
+            try:
+                result = fn(*args)
+            except grpc.RpcError as e:
+                code = e.code() if hasattr(e, "code") else None
+                if attempt < self.retries and code in RETRY_CODES:
+                    job[3] += 1
+                    with self._lock:
+                        self.retried += 1
+                        queue.appendleft(job)
+                    self.schedule(self.backoff * 2 ** attempt, peer)
+                    return
+                with self._lock:
+                    self.dropped += 1
+                print("Dropped message to {0}: {1}".format(peer.id, e))
+                continue
+            except Exception:
+                with self._lock:
+                    self.dropped += 1
+                traceback.print_exc()
+                continue
+            with self._lock:
+                self.sent += 1
+            if callback is not None:
+                try:
+                    callback(result)
+                except Exception:
+                    traceback.print_exc()
+
+    def schedule(self, delay, peer):
+        with self._timers_ready:
+            heapq.heappush(self._timers, (time.monotonic() + delay, next(self._timers_seq), peer))
+            self._timers_ready.notify()
+
+    def _run_timers(self):
+        while True:
+            with self._timers_ready:
+                while not self._timers or self._timers[0][0] > time.monotonic():
+                    self._timers_ready.wait(self._timers[0][0] - time.monotonic() if self._timers else None)
+                _, _, peer = heapq.heappop(self._timers)
+            self.pool.submit(peer.id, self.drain, peer)
+
+    def call(self, fn, *args):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                result = fn(*args)
+                with self._lock:
+                    self.sent += 1
+                return result
+            except grpc.RpcError as e:
+                code = e.code() if hasattr(e, "code") else None
+                if attempt >= self.retries or code not in RETRY_CODES:
+                    with self._lock:
+                        self.dropped += 1
+                    raise
+                with self._lock:
+                    self.retried += 1
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def send_message(self, peer, text, interactive_media_groups=None, callback=None):
+        self.enqueue(peer, self.messaging.send_message, (peer, text, interactive_media_groups), callback)
+
+    def forward(self, peer, mids, text):
+        self.enqueue(peer, self.messaging.forward, (peer, mids, text))
+
+    def update_message(self, message, text):
+        self.enqueue(message.peer, self.messaging.update_message, (message, text))
+
+    def get_messages_by_id(self, mids):
+        return self.call(self.messaging.get_messages_by_id, mids)
+
+    def post(self, peer, text):
+        with self._lock:
+            queue = self._queues.get(peer.id)
+            if queue and queue[-1][0] == self.send_texts:
+                texts = queue[-1][1][1]
+                if len(texts) >= self.max_pending:
+                    self.dropped += 1
+                else:
+                    texts.append(text)
+                    self.merged += 1
+                return
+        self.enqueue(peer, self.send_texts, (peer, [text]))
+
+    def send_texts(self, peer, texts):
+        return self.messaging.send_message(peer, "\n\n".join(texts))
+
+    def pending(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self):
+        return {"sent": self.sent, "retried": self.retried, "dropped": self.dropped, "merged": self.merged,
+                "deferred": self.deferred}
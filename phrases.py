@@ -0,0 +1,28 @@
+import glob
+import os
+
+import i18n
+import yaml
+
+
+class Phrases:
+    def __init__(self, locales, namespace="phrases"):
+        self.tables = {}
+        keys = set()
+        for path in i18n.load_path:
+            for filename in glob.glob(os.path.join(path, "{}.*.yml".format(namespace))):
+                with open(filename, encoding="utf-8") as f:
+                    for locale, sections in yaml.safe_load(f).items():
+                        for section, phrases in sections.items():
+                            keys.update("{0}.{1}.{2}".format(namespace, section, key) for key in phrases)
+        for locale in locales:
+            self.tables[locale] = {key: i18n.t(key, locale=locale) for key in keys}
+
+    def t(self, key, locale):
+        table = self.tables.get(locale)
+        if table is None:
+            return i18n.t(key, locale=locale)
+        text = table.get(key)
+        if text is None:
+            text = table[key] = i18n.t(key, locale=locale)
+        return text
@@ -0,0 +1,38 @@
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, block=True):
+        if not self.rate:
+            return True
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            if not block:
+                return False
+            wait = (1 - self.tokens) / self.rate
+            self.tokens -= 1
+        time.sleep(wait)
+        return True
+
+    def delay(self):
+        if not self.rate:
+            return 0
+        with self._lock:
+            self._refill()
+            return max(0.0, (1 - self.tokens) / self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
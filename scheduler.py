@@ -0,0 +1,54 @@
+import threading
+
+MINUTES_PER_DAY = 1440
+
+
+def minute_of_day(time):
+    hour, minute = time.split(":")
+    return int(hour) * 60 + int(minute)
+
+
+class TimingWheel:
+    def __init__(self):
+        self.slots = [None] * MINUTES_PER_DAY
+        self.watermark = None
+        self.fired = 0
+        self.caught_up = 0
+        self._lock = threading.Lock()
+
+    def add(self, time, uid):
+        slot = minute_of_day(time)
+        with self._lock:
+            if self.slots[slot] is None:
+                self.slots[slot] = {uid}
+            else:
+                self.slots[slot].add(uid)
+
+    def remove(self, time, uid):
+        slot = minute_of_day(time)
+        with self._lock:
+            if self.slots[slot] is not None:
+                self.slots[slot].discard(uid)
+                if not self.slots[slot]:
+                    self.slots[slot] = None
+
+    def due(self, now):
+        with self._lock:
+            if self.watermark is not None and self.watermark >= now:
+                return set()
+            if self.watermark is None:
+                start = now
+            else:
+                start = max(self.watermark + 1, now - MINUTES_PER_DAY + 1)
+            self.watermark = now
+            uids = set()
+            for minute in range(start, now + 1):
+                slot = self.slots[minute % MINUTES_PER_DAY]
+                if slot:
+                    uids.update(slot)
+            self.fired += 1
+            self.caught_up += now - start
+        return uids
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots if slot)
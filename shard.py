@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import traceback
+
+import i18n
+from dialog_api import peers_pb2
+
+from bot import PROFILE_UPDATES, Bot, get_bot
+
+QUEUE_SIZE = 10000
+
+
+def owner(uid, shards):
+    return uid % shards
+
+
+def run_shard(config, shard, shards, updates):
+    i18n.load_path.append(os.path.dirname(__file__) + '/translations')
+    Bot(config, shard=shard, shards=shards).start(updates)
+
+
+class Router:
+    def __init__(self, config, queues):
+        self.queues = queues
+        self.shards = len(queues)
+        self.routed = [0] * self.shards
+        self.bot = get_bot(config)
+
+    def route(self, shards, kind, update):
+        for shard in shards:
+            self.queues[shard].put((kind, update))
+            self.routed[shard] += 1
+
+    def on_msg(self, *params):
+        try:
+            update = params[0]
+            peer = update.peer
+            if peer.type != peers_pb2.PEERTYPE_GROUP:
+                self.route([owner(peer.id, self.shards)], "msg", update)
+                return
+            mentions = update.message.textMessage.mentions
+            if update.message.serviceMessage.ext or 0 in mentions:
+                self.route(range(self.shards), "msg", update)
+            elif update.message.textMessage.text and mentions:
+                self.route({owner(uid, self.shards) for uid in mentions}, "msg", update)
+        except Exception:
+            traceback.print_exc()
+
+    def on_event(self, *params):
+        try:
+            self.route([owner(params[0].uid, self.shards)], "event", params[0])
+        except Exception:
+            traceback.print_exc()
+
+    def on_update(self, update):
+        try:
+            kind = update.WhichOneof("update")
+            if kind in PROFILE_UPDATES:
+                self.route([owner(getattr(update, kind).uid, self.shards)], "update", update)
+        except Exception:
+            traceback.print_exc()
+
+    def start(self):
+        self.bot.messaging.on_message(self.on_msg, self.on_event, self.on_update)
+
+
+def start_sharded(config):
+    shards = config["shards"]
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(config.get("shard_queue_size", QUEUE_SIZE)) for _ in range(shards)]
+    processes = [
+        context.Process(target=run_shard, args=(config, shard, shards, queues[shard]), name="shard-{}".format(shard))
+        for shard in range(shards)
+    ]
+    for process in processes:
+        process.start()
+    Router(config, queues).start()
+    for process in processes:
+        process.join()
@@ -0,0 +1,138 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+LEGACY_TABLES = {
+    "users": "CREATE TABLE users (uid integer, gid integer, PRIMARY KEY (uid, gid)) WITHOUT ROWID",
+    "reminder": "CREATE TABLE reminder (time text, uid integer, PRIMARY KEY (time, uid)) WITHOUT ROWID",
+}
+
+
+def migrate_1(cursor):
+    tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for name, create in LEGACY_TABLES.items():
+        if name in tables:
+            cursor.execute("ALTER TABLE {0} RENAME TO {0}_legacy".format(name))
+        cursor.execute(create)
+        if name in tables:
+            cursor.execute("INSERT OR IGNORE INTO {0} SELECT * FROM {0}_legacy".format(name))
+            cursor.execute("DROP TABLE {0}_legacy".format(name))
+    cursor.execute("CREATE INDEX reminder_uid ON reminder (uid)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS mentions "
+                   "(uid integer, gid integer, msb integer, lsb integer, time integer)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS mentions_uid_gid ON mentions (uid, gid)")
+
+
+def migrate_2(cursor):
+    cursor.execute("CREATE TABLE groups (gid integer PRIMARY KEY, access_hash integer, title text, shortname text, "
+                   "invite_url text, members blob, updated integer)")
+
+
+def migrate_3(cursor):
+    cursor.execute("DELETE FROM mentions WHERE rowid NOT IN "
+                   "(SELECT MIN(rowid) FROM mentions GROUP BY uid, gid, msb, lsb)")
+    cursor.execute("DROP INDEX IF EXISTS mentions_uid_gid")
+    cursor.execute("CREATE UNIQUE INDEX mentions_uid_gid_mid ON mentions (uid, gid, msb, lsb)")
+
+
+def migrate_4(cursor):
+    cursor.execute("CREATE TABLE mentions_overflow (uid integer, gid integer, count integer, "
+                   "PRIMARY KEY (uid, gid)) WITHOUT ROWID")
+
+
+MIGRATIONS = [migrate_1, migrate_2, migrate_3, migrate_4]
+
+
+class Storage:
+    def __init__(self, path):
+        self.connect = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connect.execute("PRAGMA journal_mode = WAL")
+        self.connect.execute("PRAGMA synchronous = NORMAL")
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            if self.connect.in_transaction:
+                yield self.connect
+                return
+            self.connect.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connect
+            except BaseException:
+                self.connect.execute("ROLLBACK")
+                raise
+            self.connect.execute("COMMIT")
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.connect.execute(sql, params).fetchall()
+
+    def migrate(self):
+        with self.transaction() as connect:
+            connect.execute("CREATE TABLE IF NOT EXISTS schema_version (version integer)")
+            row = connect.execute("SELECT version FROM schema_version").fetchone()
+            version = row[0] if row else 0
+            cursor = connect.cursor()
+            for migration in MIGRATIONS[version:]:
+                migration(cursor)
+            if row is None:
+                connect.execute("INSERT INTO schema_version values (?)", [len(MIGRATIONS)])
+            else:
+                connect.execute("UPDATE schema_version SET version = ?", [len(MIGRATIONS)])
+        return version
+
+    def load_users(self, shard=0, shards=1):
+        return self.query("SELECT uid, gid FROM users WHERE ((uid % ?) + ?) % ? = ?", [shards, shards, shards, shard])
+
+    def add_user_groups(self, uid, gids):
+        with self.transaction() as connect:
+            connect.executemany("INSERT OR IGNORE INTO users values (?, ?)", [(uid, gid) for gid in gids])
+
+    def remove_user_group(self, uid, gid):
+        with self.transaction() as connect:
+            connect.execute("DELETE FROM users WHERE uid = ? AND gid = ?", [uid, gid])
+
+    def remove_group_users(self, gid, uids):
+        with self.transaction() as connect:
+            connect.executemany("DELETE FROM users WHERE uid = ? AND gid = ?", [(uid, gid) for uid in uids])
+
+    def remove_user(self, uid):
+        with self.transaction() as connect:
+            connect.execute("DELETE FROM users WHERE uid = ?", [uid])
+            connect.execute("DELETE FROM reminder WHERE uid = ?", [uid])
+
+    def load_reminders(self, shard=0, shards=1):
+        return self.query("SELECT time, uid FROM reminder WHERE ((uid % ?) + ?) % ? = ?",
+                          [shards, shards, shards, shard])
+
+    def add_reminder(self, uid, time):
+        with self.transaction() as connect:
+            connect.execute("INSERT OR IGNORE INTO reminder values (?, ?)", [time, uid])
+
+    def remove_reminder(self, uid, time):
+        with self.transaction() as connect:
+            connect.execute("DELETE FROM reminder WHERE time = ? AND uid = ?", [time, uid])
+
+    def remove_reminders(self, uid):
+        with self.transaction() as connect:
+            connect.execute("DELETE FROM reminder WHERE uid = ?", [uid])
+
+    def load_groups(self, since=0):
+        return self.query("SELECT gid, access_hash, title, shortname, invite_url, members, updated FROM groups "
+                          "WHERE updated >= ?", [since])
+
+    def load_group_ids(self):
+        return self.query("SELECT gid FROM groups")
+
+    def save_groups(self, groups):
+        updated = int(time.time())
+        rows = [(group.peer.id, group.peer.access_hash, group.title, group.shortname, group.invite_url,
+                 group.user_ids.to_bytes(), updated) for group in groups]
+        with self.transaction() as connect:
+            connect.executemany("INSERT OR REPLACE INTO groups values (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def remove_groups(self, gids):
+        with self.transaction() as connect:
+            connect.executemany("DELETE FROM groups WHERE gid = ?", [(gid,) for gid in gids])
@@ -0,0 +1,48 @@
+import unittest
+
+from intset import IntSet
+
+
+class DiffTest(unittest.TestCase):
+    def diff(self, old, new):
+        added, removed = IntSet(old).diff(IntSet(new))
+        self.assertEqual(added, sorted(set(new) - set(old)))
+        self.assertEqual(removed, sorted(set(old) - set(new)))
+        return added, removed
+
+    def test_equal(self):
+        self.assertEqual(self.diff([1, 2, 3], [3, 2, 1]), ([], []))
+
+    def test_empty(self):
+        self.assertEqual(self.diff([], []), ([], []))
+        self.assertEqual(self.diff([], [2, 1]), ([1, 2], []))
+        self.assertEqual(self.diff([2, 1], []), ([], [1, 2]))
+
+    def test_interleaved(self):
+        self.assertEqual(self.diff([1, 3, 5, 7], [2, 3, 6, 7, 8]), ([2, 6, 8], [1, 5]))
+
+    def test_disjoint(self):
+        self.assertEqual(self.diff([1, 2], [3, 4]), ([3, 4], [1, 2]))
+        self.assertEqual(self.diff([3, 4], [1, 2]), ([1, 2], [3, 4]))
+
+    def test_negative_and_bounds(self):
+        self.diff([-2147483648, -5, 0, 2147483647], [-5, -1, 2147483647])
+
+    def test_duplicates_collapse(self):
+        self.assertEqual(self.diff([1, 1, 2], [2, 2, 3]), ([3], [1]))
+
+    def test_after_add_and_discard(self):
+        old = IntSet([1, 2, 3])
+        new = IntSet([1, 2, 3])
+        new.add(4)
+        new.add(0)
+        new.discard(2)
+        self.assertEqual(old.diff(new), ([0, 4], [2]))
+
+    def test_from_bytes(self):
+        old = IntSet([5, -1, 9])
+        self.assertEqual(old.diff(IntSet.from_bytes(old.to_bytes())), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
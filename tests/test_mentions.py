@@ -0,0 +1,66 @@
+import sqlite3
+import time
+import unittest
+
+from dialog_api import definitions_pb2
+
+from mentions import MentionStore
+from storage import Storage
+
+FAIL_INSERT = ("CREATE TEMP TRIGGER fail_insert BEFORE INSERT ON main.mentions "
+               "BEGIN SELECT RAISE(ABORT, 'database is locked'); END")
+
+
+def mid(lsb):
+    return definitions_pb2.UUIDValue(msb=1, lsb=lsb)
+
+
+class FlushTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = Storage(":memory:")
+        self.storage.migrate()
+        self.mentions = MentionStore(self.storage, flush_interval=0.01)
+
+    def stored(self, uid):
+        return self.storage.query("SELECT gid, lsb FROM mentions WHERE uid = ? ORDER BY rowid", [uid])
+
+    def test_failed_insert_keeps_batch(self):
+        self.mentions.add(1, 10, mid(1))
+        self.mentions.add(1, 11, mid(2))
+        self.storage.connect.execute(FAIL_INSERT)
+        with self.assertRaises(sqlite3.DatabaseError):
+            self.mentions.flush()
+        self.assertEqual(self.mentions.pending(), 2)
+        self.assertEqual(self.mentions.flushed, 0)
+        self.assertEqual(self.stored(1), [])
+
+        self.storage.connect.execute("DROP TRIGGER fail_insert")
+        self.mentions.add(1, 10, mid(3))
+        self.mentions.flush()
+        self.assertEqual(self.mentions.pending(), 0)
+        self.assertEqual(self.mentions.flushed, 3)
+        self.assertEqual(self.stored(1), [(10, 1), (11, 2), (10, 3)])
+
+    def test_flusher_retries_after_failure(self):
+        self.storage.connect.execute(FAIL_INSERT)
+        self.mentions.start(sweep=False)
+        self.mentions.add(1, 10, mid(1))
+        time.sleep(0.05)
+        self.assertEqual(self.mentions.pending(), 1)
+
+        self.storage.connect.execute("DROP TRIGGER fail_insert")
+        deadline = time.monotonic() + 2
+        while self.mentions.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.stored(1), [(10, 1)])
+
+    def test_get_flushes_pending(self):
+        self.mentions.add(1, 10, mid(1))
+        groups, overflow = self.mentions.get(1)
+        self.assertEqual(list(groups), [10])
+        self.assertEqual(overflow, {})
+        self.assertEqual(self.mentions.pending(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+import grpc
+
+from outbox import Outbox
+from workers import WorkerPool
+
+
+class RpcError(grpc.RpcError):
+    def __init__(self, code):
+        self._code = code
+
+    def code(self):
+        return self._code
+
+
+class FakeMessaging:
+    def __init__(self, failures=(), gate=False):
+        self.calls = []
+        self.failures = list(failures)
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        if not gate:
+            self.gate.set()
+        self._lock = threading.Lock()
+
+    def send_message(self, peer, text, interactive_media_groups=None):
+        self.entered.set()
+        self.gate.wait()
+        with self._lock:
+            self.calls.append((peer.id, text, time.monotonic()))
+            if self.failures:
+                failure = self.failures.pop(0)
+                if failure is not None:
+                    raise RpcError(failure)
+            return SimpleNamespace(mid=len(self.calls))
+
+    def sent(self):
+        with self._lock:
+            return [(uid, text) for uid, text, _ in self.calls]
+
+
+def peer(uid):
+    return SimpleNamespace(id=uid)
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = WorkerPool("test-outbox", 1)
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def outbox(self, messaging, **kwargs):
+        kwargs.setdefault("rate", 0)
+        kwargs.setdefault("peer_rate", 0)
+        return Outbox(messaging, self.pool, **kwargs)
+
+    def wait_for(self, condition, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("timed out")
+            time.sleep(0.005)
+
+    def test_post_merges_into_unsent_tail_only(self):
+        messaging = FakeMessaging(gate=True)
+        outbox = self.outbox(messaging)
+        results = []
+        outbox.post(peer(1), "a")
+        messaging.entered.wait(1)
+        outbox.post(peer(1), "b")
+        outbox.post(peer(1), "c")
+        outbox.send_message(peer(1), "d", callback=results.append)
+        outbox.post(peer(1), "e")
+        outbox.post(peer(1), "f")
+        messaging.gate.set()
+        self.wait_for(lambda: len(messaging.sent()) == 4)
+        self.pool.join()
+        self.assertEqual(messaging.sent(), [(1, "a"), (1, "b\n\nc"), (1, "d"), (1, "e\n\nf")])
+        self.assertEqual([result.mid for result in results], [3])
+        self.assertEqual(outbox.merged, 2)
+        self.assertEqual(outbox.pending(), 0)
+
+    def test_post_caps_merged_texts(self):
+        messaging = FakeMessaging(gate=True)
+        outbox = self.outbox(messaging, max_pending=3)
+        outbox.post(peer(1), "a")
+        messaging.entered.wait(1)
+        for text in ("b", "c", "d", "e", "f"):
+            outbox.post(peer(1), text)
+        messaging.gate.set()
+        self.wait_for(lambda: len(messaging.sent()) == 2)
+        self.pool.join()
+        self.assertEqual(messaging.sent(), [(1, "a"), (1, "b\n\nc\n\nd")])
+        self.assertEqual(outbox.merged, 2)
+        self.assertEqual(outbox.dropped, 2)
+
+    def test_peers_do_not_share_tail(self):
+        messaging = FakeMessaging(gate=True)
+        outbox = self.outbox(messaging)
+        outbox.post(peer(1), "a")
+        messaging.entered.wait(1)
+        outbox.post(peer(1), "b")
+        outbox.post(peer(2), "c")
+        messaging.gate.set()
+        self.wait_for(lambda: len(messaging.sent()) == 3)
+        self.assertEqual(sorted(messaging.sent()), [(1, "a"), (1, "b"), (2, "c")])
+        self.assertEqual(outbox.merged, 0)
+
+    def test_retries_with_backoff(self):
+        messaging = FakeMessaging(failures=[grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.UNAVAILABLE])
+        outbox = self.outbox(messaging, retries=3, backoff=0.02)
+        outbox.send_message(peer(1), "a")
+        outbox.send_message(peer(1), "b")
+        self.wait_for(lambda: len(messaging.sent()) == 4)
+        self.assertEqual(messaging.sent(), [(1, "a"), (1, "a"), (1, "a"), (1, "b")])
+        stamps = [stamp for _, _, stamp in messaging.calls]
+        self.assertGreaterEqual(stamps[1] - stamps[0], 0.02)
+        self.assertGreaterEqual(stamps[2] - stamps[1], 0.04)
+        self.assertEqual(outbox.retried, 2)
+        self.assertEqual(outbox.sent, 2)
+        self.assertEqual(outbox.dropped, 0)
+
+    def test_drops_after_retries(self):
+        messaging = FakeMessaging(failures=[grpc.StatusCode.RESOURCE_EXHAUSTED] * 3)
+        outbox = self.outbox(messaging, retries=2, backoff=0.01)
+        outbox.send_message(peer(1), "a")
+        outbox.send_message(peer(1), "b")
+        self.wait_for(lambda: len(messaging.sent()) == 4)
+        self.assertEqual(messaging.sent(), [(1, "a"), (1, "a"), (1, "a"), (1, "b")])
+        self.assertEqual(outbox.retried, 2)
+        self.assertEqual(outbox.dropped, 1)
+        self.assertEqual(outbox.sent, 1)
+
+    def test_drops_without_retry_on_other_codes(self):
+        messaging = FakeMessaging(failures=[grpc.StatusCode.INVALID_ARGUMENT])
+        outbox = self.outbox(messaging, backoff=0.01)
+        outbox.send_message(peer(1), "a")
+        outbox.send_message(peer(1), "b")
+        self.wait_for(lambda: len(messaging.sent()) == 2)
+        self.pool.join()
+        self.assertEqual(messaging.sent(), [(1, "a"), (1, "b")])
+        self.assertEqual(outbox.retried, 0)
+        self.assertEqual(outbox.dropped, 1)
+
+    def test_defers_peer_without_blocking_worker(self):
+        messaging = FakeMessaging()
+        outbox = self.outbox(messaging, peer_rate=10, peer_burst=1)
+        started = time.monotonic()
+        outbox.send_message(peer(1), "a")
+        outbox.send_message(peer(1), "b")
+        outbox.send_message(peer(2), "c")
+        self.wait_for(lambda: len(messaging.sent()) == 3)
+        self.assertEqual(messaging.sent(), [(1, "a"), (2, "c"), (1, "b")])
+        stamps = [stamp for _, _, stamp in messaging.calls]
+        self.assertLess(stamps[1] - started, 0.05)
+        self.assertGreaterEqual(stamps[2] - stamps[0], 0.08)
+        self.assertGreaterEqual(outbox.deferred, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from scheduler import MINUTES_PER_DAY, TimingWheel
+
+DAY = 20000 * MINUTES_PER_DAY
+
+
+class DueTest(unittest.TestCase):
+    def setUp(self):
+        self.wheel = TimingWheel()
+
+    def test_first_call_fires_current_minute_only(self):
+        self.wheel.add("09:59", 1)
+        self.wheel.add("10:00", 2)
+        self.assertEqual(self.wheel.due(DAY + 600), {2})
+        self.assertEqual(self.wheel.caught_up, 0)
+
+    def test_same_minute_fires_once(self):
+        self.wheel.add("10:00", 1)
+        self.assertEqual(self.wheel.due(DAY + 600), {1})
+        self.assertEqual(self.wheel.due(DAY + 600), set())
+        self.assertEqual(self.wheel.due(DAY + 599), set())
+        self.assertEqual(self.wheel.fired, 1)
+
+    def test_catches_up_missed_minutes(self):
+        self.wheel.add("10:01", 1)
+        self.wheel.add("10:02", 2)
+        self.wheel.add("10:04", 3)
+        self.wheel.due(DAY + 600)
+        self.assertEqual(self.wheel.due(DAY + 603), {1, 2})
+        self.assertEqual(self.wheel.caught_up, 2)
+
+    def test_wraps_around_midnight(self):
+        self.wheel.add("23:58", 1)
+        self.wheel.add("23:59", 2)
+        self.wheel.add("00:00", 3)
+        self.wheel.add("00:01", 4)
+        self.wheel.due(DAY - 2)
+        self.assertEqual(self.wheel.due(DAY + 1), {2, 3, 4})
+
+    def test_catch_up_capped_at_one_day(self):
+        self.wheel.add("10:00", 1)
+        self.wheel.add("23:59", 2)
+        self.wheel.due(DAY)
+        self.assertEqual(self.wheel.due(DAY + 3 * MINUTES_PER_DAY), {1, 2})
+        self.assertEqual(self.wheel.caught_up, MINUTES_PER_DAY - 1)
+
+    def test_removed_uid_does_not_fire(self):
+        self.wheel.add("10:00", 1)
+        self.wheel.add("10:00", 2)
+        self.wheel.remove("10:00", 1)
+        self.assertEqual(self.wheel.due(DAY + 600), {2})
+        self.wheel.remove("10:00", 2)
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.wheel.due(DAY + 600 + MINUTES_PER_DAY), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
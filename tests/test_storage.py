@@ -0,0 +1,35 @@
+import unittest
+
+from shard import owner
+from storage import Storage
+
+UIDS = [-2147483648, -7, -3, -1, 0, 1, 5, 7, 2147483647]
+
+
+class ShardFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = Storage(":memory:")
+        self.storage.migrate()
+        for uid in UIDS:
+            self.storage.add_user_groups(uid, [100])
+            self.storage.add_reminder(uid, "10:00")
+
+    def test_negative_uid_owner(self):
+        self.assertEqual(owner(-7, 3), 2)
+        self.assertEqual(owner(-3, 3), 0)
+
+    def test_users_loaded_by_owning_shard(self):
+        for shards in (1, 2, 3, 4):
+            for shard in range(shards):
+                uids = sorted(uid for uid, _ in self.storage.load_users(shard, shards))
+                self.assertEqual(uids, [uid for uid in UIDS if owner(uid, shards) == shard])
+
+    def test_reminders_loaded_by_owning_shard(self):
+        for shards in (1, 2, 3, 4):
+            for shard in range(shards):
+                uids = sorted(uid for _, uid in self.storage.load_reminders(shard, shards))
+                self.assertEqual(uids, [uid for uid in UIDS if owner(uid, shards) == shard])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import time
+import unittest
+
+from mentions import MentionStore
+from storage import Storage
+
+
+class SweepTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = Storage(":memory:")
+        self.storage.migrate()
+
+    def store(self, **kwargs):
+        kwargs.setdefault("max_per_user", 0)
+        kwargs.setdefault("max_per_group", 0)
+        kwargs.setdefault("max_age", 0)
+        return MentionStore(self.storage, **kwargs)
+
+    def insert(self, uid, gid, lsb, created=None):
+        created = int(time.time()) if created is None else created
+        with self.storage.transaction() as connect:
+            connect.execute("INSERT INTO mentions values (?, ?, ?, ?, ?)", [uid, gid, 1, lsb, created])
+
+    def stored(self, uid):
+        return self.storage.query("SELECT gid, lsb FROM mentions WHERE uid = ? ORDER BY rowid", [uid])
+
+    def overflow(self, uid):
+        return dict(self.storage.query("SELECT gid, count FROM mentions_overflow WHERE uid = ?", [uid]))
+
+    def test_group_cap_keeps_newest(self):
+        mentions = self.store(max_per_group=2)
+        for lsb in range(1, 6):
+            self.insert(1, 10, lsb)
+        self.insert(1, 11, 6)
+        mentions.sweep()
+        self.assertEqual(self.stored(1), [(10, 4), (10, 5), (11, 6)])
+        self.assertEqual(self.overflow(1), {10: 3})
+        self.assertEqual(mentions.trimmed, 3)
+
+    def test_user_cap_keeps_newest(self):
+        mentions = self.store(max_per_user=3)
+        for lsb, gid in enumerate([10, 11, 10, 11, 10], 1):
+            self.insert(1, gid, lsb)
+        mentions.sweep()
+        self.assertEqual(self.stored(1), [(10, 3), (11, 4), (10, 5)])
+        self.assertEqual(self.overflow(1), {10: 1, 11: 1})
+
+    def test_both_caps(self):
+        mentions = self.store(max_per_user=3, max_per_group=2)
+        for lsb, gid in enumerate([11, 11, 10, 10, 10], 1):
+            self.insert(1, gid, lsb)
+        mentions.sweep()
+        self.assertEqual(self.stored(1), [(11, 2), (10, 4), (10, 5)])
+        self.assertEqual(self.overflow(1), {10: 1, 11: 1})
+
+    def test_expires_old_mentions(self):
+        mentions = self.store(max_age=60, max_per_group=1)
+        now = int(time.time())
+        self.insert(1, 10, 1, now - 120)
+        self.insert(1, 10, 2, now - 120)
+        self.insert(1, 10, 3, now)
+        mentions.sweep()
+        self.assertEqual(self.stored(1), [(10, 3)])
+        self.assertEqual(self.overflow(1), {})
+        self.assertEqual(mentions.expired, 2)
+        self.assertEqual(mentions.trimmed, 0)
+
+    def test_overflow_accumulates(self):
+        mentions = self.store(max_per_group=1)
+        for lsb in range(1, 4):
+            self.insert(1, 10, lsb)
+        mentions.sweep()
+        self.assertEqual(self.overflow(1), {10: 2})
+        self.insert(1, 10, 4)
+        self.insert(1, 10, 5)
+        mentions.sweep()
+        self.assertEqual(self.stored(1), [(10, 5)])
+        self.assertEqual(self.overflow(1), {10: 4})
+
+        groups, overflow = mentions.pop(1)
+        self.assertEqual([mid.lsb for mid in groups[10]], [5])
+        self.assertEqual(overflow, {10: 4})
+        self.assertEqual(mentions.get(1), ({}, {}))
+
+    def test_sweeps_every_user_in_batches(self):
+        mentions = self.store(max_per_group=1, sweep_batch=2)
+        uids = [-2147483648, -3, 0, 2, 5]
+        for uid in uids:
+            self.insert(uid, 10, 1)
+            self.insert(uid, 10, 2)
+        mentions.sweep()
+        for uid in uids:
+            self.assertEqual(self.stored(uid), [(10, 2)])
+            self.assertEqual(self.overflow(uid), {10: 1})
+
+    def test_within_limits_untouched(self):
+        mentions = self.store(max_per_user=5, max_per_group=5, max_age=60)
+        self.insert(1, 10, 1)
+        self.insert(1, 11, 2)
+        mentions.sweep()
+        self.assertEqual(self.stored(1), [(10, 1), (11, 2)])
+        self.assertEqual(self.overflow(1), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+import traceback
+
+
+class WorkerPool:
+    def __init__(self, name, workers, queue_size=0, policy="block"):
+        self.name = name
+        self.policy = policy
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self._lock = threading.Lock()
+        self._queues = [queue.Queue(queue_size) for _ in range(workers)]
+        self._threads = []
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(q,), name="{0}-{1}".format(name, i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, fn, *args):
+        q = self._queues[hash(key) % len(self._queues)]
+        item = (time.monotonic(), fn, args)
+        if self.policy == "drop":
+            try:
+                q.put_nowait(item)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                return False
+        else:
+            q.put(item)
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                return
+            enqueued, fn, args = item
+            failed = False
+            try:
+                fn(*args)
+            except Exception:
+                failed = True
+                traceback.print_exc()
+            latency = time.monotonic() - enqueued
+            with self._lock:
+                self.completed += 1
+                self.failed += failed
+                self.latency_sum += latency
+                self.latency_max = max(self.latency_max, latency)
+            q.task_done()
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def join(self):
+        for q in self._queues:
+            q.join()
+
+    def stop(self):
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": self.depth(),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "latency_avg": self.latency_sum / self.completed if self.completed else 0.0,
+                "latency_max": self.latency_max,
+            }